@@ -0,0 +1,34 @@
+import os
+import pathlib
+import sys
+
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+
+from fake_touchstone import FakeTouchstone, ORIGINS, DESTINATIONS, VALIDATORS
+
+LATENCY            = float(os.environ.get("FAKE_TS_LATENCY", "0.01"))
+EXECUTION_DURATION = float(os.environ.get("FAKE_TS_DURATION", "0.2"))
+
+@pytest.fixture(scope = "session")
+def fake_touchstone():
+    with FakeTouchstone(latency = LATENCY, execution_duration = EXECUTION_DURATION) as fake:
+        yield fake
+
+@pytest.fixture
+def touchstone_class(fake_touchstone, monkeypatch):
+    """ A Touchstone class pointing to the fake server, with poll intervals scaled down to the execution duration. """
+    monkeypatch.setenv("TS_USER", "benchmark")
+    monkeypatch.setenv("TS_PASS", "benchmark")
+    from ts import Touchstone
+
+    class BenchmarkTouchstone(Touchstone):
+        BASE_URL                = fake_touchstone.base_url
+        MIN_POLL_INTERVAL       = EXECUTION_DURATION / 4
+        MAX_POLL_INTERVAL       = EXECUTION_DURATION * 2
+        API_REQUESTS_PER_SECOND = 1000
+        API_REQUEST_BURST       = 1000
+
+    fake_touchstone.requests.clear()
+    return BenchmarkTouchstone
@@ -0,0 +1,60 @@
+""" Benchmarks for launching and uploading against the fake Touchstone server. Run with:
+        pytest benchmarks
+    The latency of the fake server and the duration of each execution can be set using the environment variables
+    FAKE_TS_LATENCY and FAKE_TS_DURATION (in seconds). Besides the wall-clock time, the number of requests made to the
+    server is reported in the "extra_info" of each benchmark. """
+
+import pytest
+
+from conftest import ORIGINS, DESTINATIONS, VALIDATORS
+from ts import ExecutionTarget, UploadTarget
+
+def executionTargets(count):
+    targets = []
+    for i in range(count):
+        group = f"dev/Group{i // 10}"
+        if i % 10 == 0:
+            target = ExecutionTarget(f"{group}/_LoadResources")
+            target.setLoadScriptFolder(True)
+        else:
+            target = ExecutionTarget(f"{group}/Test{i}")
+        target.setOrigins(ORIGINS[0])
+        target.setDestinations(DESTINATIONS[0])
+        targets.append(target)
+    return targets
+
+def uploadTargets(count, tmp_path):
+    targets = []
+    for i in range(count):
+        path = tmp_path / f"Folder{i}"
+        path.mkdir()
+        (path / "test.xml").write_text("<TestScript xmlns=\"http://hl7.org/fhir\"/>")
+        (path / "groupProps.json").write_text("{}")
+        target = UploadTarget(path, f"dev/Folder{i}", "dev")
+        target.setAccess("My organization")
+        target.validator = VALIDATORS[0]
+        targets.append(target)
+    return targets
+
+@pytest.mark.parametrize("count", [1, 50, 500])
+def test_execute_targets(benchmark, touchstone_class, fake_touchstone, count):
+    targets = executionTargets(count)
+    touchstone = touchstone_class()
+    touchstone.loginFrontend()
+
+    benchmark.pedantic(touchstone.executeTargets, args = (targets, False), rounds = 1, iterations = 1)
+
+    touchstone.logoutFrontend()
+    benchmark.extra_info["requests"] = fake_touchstone.totalRequests()
+    benchmark.extra_info["status_requests"] = fake_touchstone.requests["GET /api/testExecution/{id}"]
+    assert len(touchstone.executions) == count
+    assert all(e.status == "Passed" for e in touchstone.executions)
+
+@pytest.mark.parametrize("count", [1, 50, 500])
+def test_upload_targets(benchmark, touchstone_class, fake_touchstone, tmp_path, count):
+    targets = uploadTargets(count, tmp_path)
+
+    result = benchmark.pedantic(touchstone_class.uploadTargets, args = (targets,), rounds = 1, iterations = 1)
+
+    benchmark.extra_info["requests"] = fake_touchstone.totalRequests()
+    assert result
@@ -0,0 +1,129 @@
+""" Live status display for the executions that are being awaited. Instead of redrawing every execution on each poll,
+    it shows aggregate counters and a fixed-height viewport with the active and recently changed executions, so the
+    amount of output per repaint doesn't depend on the number of executions. """
+
+import collections
+import datetime
+import shutil
+import sys
+import time
+
+class StatusDashboard:
+    """ Renders the status of a list of Executions below a title.
+        * executions: the list of Executions to report on; it may grow while the dashboard is in use.
+        * status_line: function returning the status line for an Execution.
+        * title: the line shown above the status.
+        * min_interval: the minimum number of seconds between two repaints.
+        * stream: the stream to write to. When it's not a terminal, only the counters are written, without any cursor
+          movements, and at most once every LOG_INTERVAL seconds.
+    """
+    FINISHED_LINGER = 10  # Number of seconds a finished execution stays in the viewport
+    RATE_WINDOW     = 60  # Number of seconds over which the tests per second are measured
+    LOG_INTERVAL    = 30  # Minimal number of seconds between two status lines when not writing to a terminal
+
+    def __init__(self, executions, status_line, title = "### Status ###", min_interval = 0.5, stream = None):
+        self.executions = executions
+        self.status_line = status_line
+        self.title = title
+        self.min_interval = min_interval
+        self.stream = stream or sys.stdout
+        self.interactive = self.stream.isatty()
+        self.__height = 0             # Number of lines currently drawn
+        self.__last_render = None
+        self.__last_lines = {}        # Execution id() -> status line at the previous repaint, to detect changes
+        self.__samples = collections.deque() # (time, number of completed tests) for measuring the rate
+
+    def counters(self):
+        """ Return the aggregate counters of all executions as a dict. """
+        counters = collections.Counter()
+        for execution in self.executions:
+            if execution.status in ["Running", ""]:
+                counters["running"] += 1
+                counters["remaining"] += max(execution.total - execution.passes - execution.warns - execution.fails, 0)
+            elif execution.status == "Passed":
+                counters["passed"] += 1
+            elif execution.status == "Unknown":
+                counters["unknown"] += 1
+            else:
+                counters["failed"] += 1
+            counters["completed"] += execution.passes + execution.warns + execution.fails
+        return counters
+
+    def __rate(self, completed):
+        """ Return the number of tests completed per second over the last RATE_WINDOW seconds, or None if unknown. """
+        now = time.monotonic()
+        self.__samples.append((now, completed))
+        while len(self.__samples) > 2 and self.__samples[1][0] < now - self.RATE_WINDOW:
+            self.__samples.popleft()
+        then, completed_then = self.__samples[0]
+        if now - then < 1:
+            return None
+        return (completed - completed_then) / (now - then)
+
+    def summary(self):
+        """ Return the line with the aggregate counters, the number of tests per second and the expected time until
+            the running executions have finished. """
+        counters = self.counters()
+        line = f"{counters['running']} running, {counters['passed']} passed, {counters['failed']} failed"
+        if counters["unknown"] > 0:
+            line += f", {counters['unknown']} unknown"
+        line += f" | {counters['completed']} tests completed"
+        rate = self.__rate(counters["completed"])
+        if rate != None:
+            line += f", {rate:.1f} tests/s"
+            if rate > 0 and counters["remaining"] > 0:
+                line += f", ETA {datetime.timedelta(seconds = int(counters['remaining'] / rate))}"
+        return line
+
+    def __viewport(self, max_rows):
+        """ Return the lines for the executions that are running, or that have finished in the last FINISHED_LINGER
+            seconds. If there are more than max_rows, the ones that changed since the previous repaint go first. """
+        now = time.time()
+        visible = [e for e in self.executions if e.status in ["Running", ""] or (e.finished_at != None and now - e.finished_at < self.FINISHED_LINGER)]
+        lines = {}
+        for execution in visible:
+            lines[id(execution)] = self.status_line(execution).strip()
+        changed = set(id(e) for e in visible if self.__last_lines.get(id(e)) != lines[id(e)])
+        self.__last_lines = lines
+
+        if len(visible) > max_rows:
+            prioritized = [e for e in visible if id(e) in changed] + [e for e in visible if id(e) not in changed]
+            shown = set(id(e) for e in prioritized[:max_rows - 1])
+            rows = [e for e in visible if id(e) in shown] # Keep the order stable
+        else:
+            rows = visible
+        result = [f"- {e.target.rel_path}: {lines[id(e)]}" for e in rows]
+        if len(rows) < len(visible):
+            result.append(f"  ... and {len(visible) - len(rows)} more")
+        return result
+
+    def render(self, force = False):
+        """ Repaint the dashboard, unless the previous repaint was less than min_interval seconds ago and force is not
+            set. """
+        now = time.monotonic()
+        if not self.interactive:
+            if force or self.__last_render == None or now - self.__last_render >= self.LOG_INTERVAL:
+                self.__last_render = now
+                self.stream.write(self.summary() + "\n")
+                self.stream.flush()
+            return
+        if not force and self.__last_render != None and now - self.__last_render < self.min_interval:
+            return
+        self.__last_render = now
+
+        width, height = shutil.get_terminal_size((120, 40))
+        lines = [self.title, self.summary()] + self.__viewport(max(height - 6, 3))
+        lines = [line if len(line) < width - 1 else line[:width - 4] + "..." for line in lines] # Wrapped lines would break the cursor movements
+
+        output = f"\033[{self.__height}A" if self.__height > 0 else ""
+        output += "".join(f"\033[2K{line}\n" for line in lines) + "\033[J"
+        self.stream.write(output)
+        self.stream.flush()
+        self.__height = len(lines)
+
+    def clear(self):
+        """ Erase the dashboard from the terminal. """
+        if self.interactive and self.__height > 0:
+            self.stream.write(f"\033[{self.__height}A\033[J")
+            self.stream.flush()
+        self.__height = 0
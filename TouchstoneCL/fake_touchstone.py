@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+""" Local stand-in for the parts of Touchstone that are used by ts.py, so the scripts can be tested and benchmarked
+    without hitting touchstone.aegis.net. It serves the login form, the test definition pages (including the upload
+    form), the test setup form and the execution API. Executions "run" for a configurable duration, during which their
+    tests pass one by one. Every request can be delayed by a configurable latency, and all requests are counted.
+
+    It can be used from Python:
+        with FakeTouchstone(latency = 0.05, execution_duration = 2) as fake:
+            touchstone = Touchstone(fake.base_url)
+
+    Or started standalone:
+        python fake_touchstone.py --port 8080 --latency 0.1 --duration 30
+    after which the scripts can be pointed to it by setting Touchstone.BASE_URL to http://localhost:8080/touchstone
+"""
+
+import argparse
+import collections
+import datetime
+import email
+import email.policy
+import html
+import http.server
+import io
+import json
+import re
+import threading
+import time
+import urllib.parse
+import zipfile
+
+ORIGINS      = ["AEGIS.net, Inc. - TouchstoneFHIR"]
+DESTINATIONS = ["Nictiz - Nictiz WildFHIR V202001-Dev - FHIR 3.0.2", "Nictiz - Nictiz WildFHIR V201901-2 Dev - FHIR 3.0.2"]
+VALIDATORS   = ["Nictiz Dev", "Nictiz"]
+ACCESS       = {"My organization": "BY_MY_ORG", "My organization group(s)": "BY_MY_ORG_GROUP", "Everyone": "BY_ALL"}
+
+class FakeTouchstone:
+    """ The fake Touchstone server. It runs in a background thread between start() and stop() (or within a with block).
+        * latency: the number of seconds each request is delayed.
+        * execution_duration: the number of seconds an execution runs.
+        * tests_per_execution: the number of tests in each execution.
+        * scripts_per_group: the number of TestScripts shown for each test group.
+        * port: the port to listen on; by default a free port is chosen.
+    """
+    def __init__(self, latency = 0, execution_duration = 1, tests_per_execution = 10, scripts_per_group = 3, port = 0):
+        self.latency = latency
+        self.execution_duration = execution_duration
+        self.tests_per_execution = tests_per_execution
+        self.scripts_per_group = scripts_per_group
+        self.requests = collections.Counter() # Number of requests per "METHOD /path"
+        self.executions = {}                  # Execution id -> (start time, test group)
+        self.setups = {}                      # Execution id -> submitted fields of the test setup form
+        self.uploads = []                     # Uploaded (parent group path, file name, number of files)
+        self.__lock = threading.Lock()
+        self.__server = http.server.ThreadingHTTPServer(("localhost", port), _Handler)
+        self.__server.daemon_threads = True
+        self.__server.fake = self
+        self.__thread = None
+
+    @property
+    def base_url(self):
+        return f"http://localhost:{self.__server.server_address[1]}/touchstone"
+
+    def start(self):
+        self.__thread = threading.Thread(target = self.__server.serve_forever, daemon = True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def count(self, key):
+        with self.__lock:
+            self.requests[key] += 1
+
+    def totalRequests(self):
+        with self.__lock:
+            return sum(self.requests.values())
+
+    def startExecution(self, test_group, fields = {}):
+        with self.__lock:
+            execution_id = str(len(self.executions) + 1)
+            self.executions[execution_id] = (time.monotonic(), test_group)
+            self.setups[execution_id] = fields
+        return execution_id
+
+    def executionStatus(self, execution_id):
+        """ Return the API response for an execution, or None if it doesn't exist. """
+        with self.__lock:
+            if execution_id not in self.executions:
+                return None
+            started_at, test_group = self.executions[execution_id]
+        elapsed = time.monotonic() - started_at
+        progress = 1 if self.execution_duration <= 0 else min(elapsed / self.execution_duration, 1)
+        return {
+            "testExecId": execution_id,
+            "status": "Passed" if progress >= 1 else "Running",
+            "duration": str(datetime.timedelta(seconds = int(elapsed))),
+            "statusCounts": {
+                "numberOfTests": self.tests_per_execution,
+                "numberOfTestPasses": int(self.tests_per_execution * progress)
+            }
+        }
+
+    def addUpload(self, parent_group_path, file_name, num_files):
+        with self.__lock:
+            self.uploads.append((parent_group_path, file_name, num_files))
+
+def _page(body, title = "Touchstone"):
+    return f"<!DOCTYPE html><html><head><title>{title}</title></head><body><a href=\"logout\">Sign Out</a>{body}</body></html>"
+
+def _options(values):
+    return "".join(f"<option value=\"{html.escape(v)}\">{html.escape(v)}</option>" for v in values)
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, like the real thing
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.__handle("GET")
+
+    def do_POST(self):
+        self.__handle("POST")
+
+    def __handle(self, method):
+        fake = self.server.fake
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = url.path.removeprefix("/touchstone")
+
+        route = re.sub(r"/\d+$", "/{id}", path)
+        fake.count(f"{method} {route}")
+        if fake.latency > 0:
+            time.sleep(fake.latency)
+
+        if method == "GET" and path == "/login":
+            self.__html(_page("""
+                <form id="loginForm" method="post" action="doLogin">
+                    <input type="text" name="emailOrLoginID"/>
+                    <input type="password" name="password"/>
+                </form>""").replace("Sign Out", "Sign In"))
+        elif method == "POST" and path == "/doLogin":
+            self.__html(_page("<p>Welcome</p>"))
+        elif method == "GET" and path == "/logout":
+            self.__html("<html><body>Signed out</body></html>")
+        elif method == "POST" and path == "/api/authenticate":
+            self.__json(201, {"API-Key": "fake-api-key"})
+        elif path.startswith("/api/") and path != "/api/authenticate" and self.headers.get("API-Key") != "fake-api-key":
+            self.__json(401, {"error": "Invalid API-Key"})
+        elif method == "GET" and path.startswith("/api/testExecution/"):
+            status = fake.executionStatus(path.split("/")[-1])
+            if status == None:
+                self.__json(404, {"error": "Not found"})
+            else:
+                self.__json(200, status)
+        elif method == "GET" and path == "/testdefinitions":
+            test_group = query.get("selectedTestGrp", [""])[0]
+            if query.get("contentEntry", [""])[0] == "TEST_SCRIPTS":
+                self.__html(self.__testDefinitionsPage(test_group))
+            else:
+                self.__html(self.__uploadPage(test_group))
+        elif method == "POST" and path == "/testSetup":
+            fields = urllib.parse.parse_qs(body.decode())
+            self.__html(self.__testSetupPage(fields.get("testGroup", [""])[0]))
+        elif method == "POST" and path == "/execute":
+            fields = urllib.parse.parse_qs(body.decode(), keep_blank_values = True)
+            if "execute" not in fields:
+                self.__html(_page("<span class=\"alertContent\">Nothing to do</span>"))
+            else:
+                execution_id = fake.startExecution(fields.get("testGroup", [""])[0], fields)
+                self.__redirect(f"{fake.base_url}/execution?exec={execution_id}")
+        elif method == "GET" and path == "/execution":
+            self.__html(_page(f"<h1>Execution {html.escape(query.get('exec', [''])[0])}</h1>"))
+        elif method == "POST" and path == "/uploadTestGroup":
+            self.__html(self.__upload(body))
+        else:
+            self.__html(_page("<p>Not found</p>"), 404)
+
+    def __testDefinitionsPage(self, test_group):
+        fake = self.server.fake
+        name = test_group.split("/")[-1]
+        scripts = [f"{test_group}/{name}-{i + 1}" for i in range(fake.scripts_per_group)]
+        if name != "_LoadResources":
+            scripts.append(f"{test_group}/_LoadResources/load-resources-purgecreateupdate-xml")
+        inputs = "".join(f"<input type=\"checkbox\" class=\"selectedId\" name=\"selectedTestScripts\" value=\"{html.escape(s)}\"/>" for s in scripts)
+        return _page(f"""
+            <form id="testDefSearch" method="post" action="testSetup">
+                <input type="hidden" name="testGroup" value="{html.escape(test_group)}"/>
+                <input type="checkbox" name="allSelected" value="true"/>
+                {inputs}
+            </form>""")
+
+    def __testSetupPage(self, test_group):
+        return _page(f"""
+            <form id="testSetupForm" method="post" action="execute">
+                <input type="hidden" name="testGroup" value="{html.escape(test_group)}"/>
+                <select id="mainorigin1TsSelect" name="testSetup.origins[0].testSystem">{_options(ORIGINS)}</select>
+                <select id="mainorigin2TsSelect" name="testSetup.origins[1].testSystem">{_options(ORIGINS)}</select>
+                <select id="maindest1TsSelect" name="testSetup.destinations[0].testSystem">{_options(DESTINATIONS)}</select>
+                <select id="maindest2TsSelect" name="testSetup.destinations[1].testSystem">{_options(DESTINATIONS)}</select>
+                <textarea name="testSetup.scripts[0].variableSetups.variableSetupMap[T]">\n2020-01-01\n</textarea>
+                <textarea name="testSetup.scripts[0].variableSetups.variableSetupMap[authorization-token-id]">\n\n</textarea>
+                <input type="hidden" class="ud_defaults" name="testSetup.scripts[0].defaults[T]" value="2020-01-01"/>
+            </form>""")
+
+    def __uploadPage(self, test_group):
+        access = "".join(f"<label><input type=\"radio\" name=\"canBeViewedBy\" value=\"{v}\"/>{html.escape(k)}</label>" for k, v in ACCESS.items())
+        return _page(f"""
+            <form id="testGroupUploadForm" method="post" action="uploadTestGroup" enctype="multipart/form-data">
+                <input type="file" name="uploadFile"/>
+                <input type="hidden" name="parentGroupPath" value="{html.escape(test_group)}"/>
+                <input type="radio" name="canBeModifiedBy" value="BY_MY_ORG"/>
+                {access}
+                <select name="validator">{_options(VALIDATORS)}</select>
+            </form>""")
+
+    def __upload(self, body):
+        message = email.message_from_bytes(b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" + body, policy = email.policy.HTTP)
+        fields = {}
+        for part in message.iter_parts():
+            fields[part.get_param("name", header = "content-disposition")] = (part.get_filename(), part.get_payload(decode = True))
+        file_name, content = fields.get("uploadFile", (None, None))
+        if not file_name or not content:
+            return _page("<span class=\"alertContent\">Please select a file to upload.</span>")
+        try:
+            num_files = len([n for n in zipfile.ZipFile(io.BytesIO(content)).namelist() if not n.endswith("/")])
+        except zipfile.BadZipFile:
+            return _page("<span class=\"alertContent\">The uploaded file is not a valid zip file.</span>")
+        parent_group_path = fields.get("parentGroupPath", (None, b""))[1].decode()
+        self.server.fake.addUpload(parent_group_path, file_name, num_files)
+        return _page(f"<span class=\"alertContent\">The zip file '{html.escape(file_name)}' containing {num_files} files has been uploaded successfully.</span>")
+
+    def __send(self, status, content_type, content, headers = {}):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def __html(self, text, status = 200):
+        self.__send(status, "text/html; charset=utf-8", text.encode())
+
+    def __json(self, status, obj):
+        self.__send(status, "application/json", json.dumps(obj).encode())
+
+    def __redirect(self, location):
+        self.__send(302, "text/html", b"", {"Location": location})
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Run a local stand-in for Touchstone")
+    parser.add_argument("--port", type = int, default = 8080)
+    parser.add_argument("--latency", type = float, default = 0, help = "Delay in seconds for each request")
+    parser.add_argument("--duration", type = float, default = 30, help = "Duration in seconds of each execution")
+    parser.add_argument("--tests", type = int, default = 10, help = "Number of tests per execution")
+    args = parser.parse_args()
+
+    fake = FakeTouchstone(args.latency, args.duration, args.tests, port = args.port)
+    print(f"Serving a fake Touchstone on {fake.base_url}")
+    fake.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        fake.stop()
@@ -0,0 +1,57 @@
+""" Durable record of the executions started by the launcher, so that a session can be resumed after the launcher has
+    crashed or has been stopped. """
+
+import datetime
+import json
+import pathlib
+import threading
+
+class ExecutionJournal:
+    """ Append-only journal in JSON Lines format. Each started and finished execution is written to it as an event,
+        together with the kind ("dev" or "production") and date T of the session. Both methods started() and
+        finished() can be used as listeners on Touchstone. """
+
+    def __init__(self, path, kind, date_T):
+        self.path = pathlib.Path(path)
+        self.kind = kind
+        self.date_T = date_T
+        self.__events = []
+        if self.path.exists():
+            with open(self.path, "r", encoding = "utf-8") as f:
+                for line in f:
+                    try:
+                        self.__events.append(json.loads(line))
+                    except ValueError:
+                        pass # A partially written line when the launcher was killed
+        self.__file = open(self.path, "a", encoding = "utf-8")
+        self.__lock = threading.Lock()
+
+    def __write(self, event):
+        event = {"at": datetime.datetime.now().isoformat(timespec = "seconds"), "kind": self.kind, "T": self.date_T} | event
+        with self.__lock:
+            self.__events.append(event)
+            self.__file.write(json.dumps(event) + "\n")
+            self.__file.flush()
+
+    def started(self, execution):
+        self.__write({"event": "started", "execution_id": execution.execution_id, "rel_path": execution.target.rel_path, "started_at": execution.started_at, "account": execution.account, "sequence": execution.sequence})
+
+    def finished(self, execution):
+        self.__write({"event": "finished", "execution_id": execution.execution_id, "rel_path": execution.target.rel_path, "status": execution.status})
+
+    def __sessionEvents(self):
+        return [e for e in self.__events if e.get("kind") == self.kind and e.get("T") == self.date_T]
+
+    def inFlight(self):
+        """ Return the "started" events of the executions in this session (same kind and date T) that have not been
+            recorded as finished. """
+        finished_ids = set(e["execution_id"] for e in self.__sessionEvents() if e["event"] == "finished")
+        return [e for e in self.__sessionEvents() if e["event"] == "started" and e["execution_id"] not in finished_ids]
+
+    def completed(self):
+        """ Return the relative paths of the targets that have finished in this session (same kind and date T). The
+            status couldn't be retrieved for executions with status "Unknown", so these are not regarded complete. """
+        return set(e["rel_path"] for e in self.__sessionEvents() if e["event"] == "finished" and e["status"] != "Unknown")
+
+    def close(self):
+        self.__file.close()
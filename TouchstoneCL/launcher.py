@@ -7,10 +7,18 @@ if __name__ == "__main__":
     parser.add_argument("-r", "--repo-root", default = pathlib.Path(".") / "../../Nictiz-testscripts")
     parser.add_argument("-f", "--properties-file", default = "properties.yml")
     parser.add_argument("--production", action = "store_true")
+    parser.add_argument("--pool-size", type = int, help = f"Number of keep-alive connections to Touchstone (default is {Touchstone.POOL_SIZE})")
     parser.add_argument("-T", help = f"Date T to use (default is '{touchstone.date_T}')")
     parser.add_argument("--start-only", action = "store_true", help = "Just launch the executions, don't wait for them to finish and don't report the results, unless it's explicitly defined that an execution should finish before continuing")
     parser.add_argument("--jira-table", action = "store_true", help = "Print a summary in Jira ;ost format after completion (ignored if --start-only is provided)")
-    parser.add_argument("target", nargs = "*", help = "The targets to execute (both numbers and mnemonics are supported)")
+    parser.add_argument("--results-jsonl", help = "Append the results of each execution to this JSON Lines file as soon as it finishes")
+    parser.add_argument("--junit-xml", help = "Write the results of the executions to this JUnit XML file, updated as soon as each execution finishes")
+    parser.add_argument("--journal", default = ".launcher-journal.jsonl", help = "File to keep track of started and finished executions, used by --resume (default is '.launcher-journal.jsonl')")
+    parser.add_argument("--metrics", default = ".launcher-metrics.sqlite", help = "Database with the durations and results of earlier executions, used to start the longest targets first and to report targets that have become slower (default is '.launcher-metrics.sqlite')")
+    parser.add_argument("--resume", action = "store_true", help = "Resume a previous session with the same date T: reattach to the executions that were still running and skip targets that have already completed")
+    parser.add_argument("--changed", metavar = "REVISION_RANGE", help = "Execute the targets affected by the changes in the testscripts repo for this git revision range (e.g. 'main..HEAD', or 'HEAD~3' to include uncommitted changes), on top of the specified targets")
+    parser.add_argument("--accounts", type = int, help = "Maximum number of accounts to spread the executions over (default is all accounts defined using TS_USER/TS_PASS and TS_USER_1/TS_PASS_1, TS_USER_2/TS_PASS_2, etc.)")
+    parser.add_argument("target", nargs = "*", help = "The targets to execute (numbers, relative paths, glob patterns and mnemonics are supported)")
     args = parser.parse_args()
 
     known_targets = KnownTargets(args.repo_root, args.properties_file)
@@ -18,8 +26,14 @@ if __name__ == "__main__":
     if args.T != None:
         touchstone.date_T = args.T
     touchstone.start_only = args.start_only
+    touchstone.addAccounts(Touchstone.credentials()[:args.accounts])
+    if args.pool_size != None:
+        for account in touchstone.accounts:
+            account.setPoolSize(args.pool_size)
 
-    if len(args.target) == 0:
+    if len(args.target) == 0 and (args.resume or args.changed != None):
+        folders = []
+    elif len(args.target) == 0:
         known_targets.list(exclude_reference=True)
         print()
         folders = input("Please specify the folders to execute (space separated) ")
@@ -27,11 +41,56 @@ if __name__ == "__main__":
     else:
         folders = args.target
 
+    sinks = []
+    if args.results_jsonl != None:
+        sinks.append(JsonLinesSink(args.results_jsonl))
+    if args.junit_xml != None:
+        sinks.append(JUnitSink(args.junit_xml))
+    touchstone.listeners += sinks
+
+    kind = "production" if args.production else "dev"
+    journal = ExecutionJournal(args.journal, kind, touchstone.date_T)
+    touchstone.start_listeners.append(journal.started)
+    touchstone.listeners.append(journal.finished)
+    metrics = MetricsStore(args.metrics)
+    touchstone.listeners.append(metrics.record)
+
     try:
-        touchstone.loginFrontend()
+        if len(touchstone.accounts) > 1:
+            print(f"Spreading the executions over {len(touchstone.accounts)} accounts")
+        for account in touchstone.accounts:
+            account.loginFrontend()
+
+        targets = known_targets.getExecutionTargets(folders, kind)
+        if args.changed != None:
+            selected = set(t.rel_path for t in targets)
+            changed = [t for t in known_targets.getChangedExecutionTargets(args.changed, kind) if t.rel_path not in selected]
+            if len(changed) == 0:
+                print(f"No targets are affected by the changes in {args.changed}")
+            targets = ExecutionScheduler.order(targets + changed)
+        if len(targets) != len(folders) or args.changed != None:
+            print("The following targets will be executed:")
+            for target in targets:
+                print(f"- {target.rel_path}")
+
+        if args.resume:
+            for event in journal.inFlight():
+                print(f"- Reattaching to the execution of {event['rel_path']}")
+                touchstone.reattach(known_targets.getExecutionTarget(event["rel_path"], kind), event["execution_id"], event["started_at"], event.get("account"))
+            completed = journal.completed()
+            for target in [t for t in targets if t.rel_path in completed]:
+                print(f"- Skipping {target.rel_path}, it has already been executed for T = {touchstone.date_T}")
+            targets = [t for t in targets if t.rel_path not in completed]
+        rel_paths = set(t.rel_path for t in targets)
+        history = metrics.history(rel_paths)
+        touchstone.executeTargets(targets, args.start_only, metrics.expectedDurations(rel_paths))
 
-        targets = [known_targets.getExecutionTarget(folder_num, "production" if args.production else "dev") for folder_num in folders]
-        touchstone.executeTargets(targets, args.start_only)
+        regressions = metrics.regressions(touchstone.executions, history)
+        if len(regressions) > 0:
+            print("### Slower than usual ###")
+            for execution, elapsed, median in regressions:
+                print(f"- {execution.target.rel_path}: took {datetime.timedelta(seconds = int(elapsed))}, usually {datetime.timedelta(seconds = int(median))}")
+            print()
 
         if not args.start_only and args.jira_table:
             print("### Jira list ###")
@@ -43,7 +102,7 @@ if __name__ == "__main__":
                     line += "⚠️"
                 else:
                     line += "✅"
-                line += f" [{execution.target.rel_path}](https://touchstone.aegis.net/touchstone/execution?exec={execution.execution_id})"
+                line += f" [{execution.target.rel_path}]({execution.url})"
                 if execution.fails > 0 or execution.warns > 0:
                     line += ": "
                     if execution.fails > 0:
@@ -56,4 +115,9 @@ if __name__ == "__main__":
 
     finally:
         # Always try to logout, otherwise we'll have too many open sessions.
-        touchstone.logoutFrontend()
+        for account in touchstone.accounts:
+            account.logoutFrontend()
+        for sink in sinks:
+            sink.close()
+        journal.close()
+        metrics.close()
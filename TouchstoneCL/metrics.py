@@ -0,0 +1,83 @@
+""" Local history of the results of Touchstone executions, used to predict how long a target will take and to spot
+    targets that have become slower. The history is kept in a SQLite database with one row per finished execution. """
+
+import sqlite3
+import statistics
+import threading
+import time
+
+class MetricsStore:
+    """ SQLite database with the duration and results of each finished execution, per relative path. The record()
+        method can be used as a listener on Touchstone. """
+    HISTORY           = 20  # Number of most recent executions of a target to base the expected duration on
+    MIN_HISTORY       = 3   # Minimal number of earlier executions before a regression can be flagged
+    REGRESSION_FACTOR = 1.5 # An execution is flagged when it took this much longer than the historical median...
+    REGRESSION_MARGIN = 30  # ... and at least this number of seconds longer
+
+    def __init__(self, path):
+        self.__db = sqlite3.connect(path, check_same_thread = False)
+        self.__lock = threading.Lock()
+        with self.__lock, self.__db:
+            self.__db.execute("""CREATE TABLE IF NOT EXISTS executions (
+                rel_path TEXT NOT NULL,
+                execution_id TEXT,
+                account TEXT,
+                status TEXT,
+                started_at REAL,
+                finished_at REAL,
+                elapsed REAL,
+                duration TEXT,
+                total INTEGER,
+                passes INTEGER,
+                warns INTEGER,
+                fails INTEGER)""")
+            self.__db.execute("CREATE INDEX IF NOT EXISTS executions_rel_path ON executions (rel_path, finished_at)")
+
+    def record(self, execution):
+        """ Store the results of a finished Execution. Executions for which the status couldn't be retrieved are
+            skipped. """
+        if execution.status in ["Running", "", "Unknown"]:
+            return
+        finished_at = execution.finished_at or time.time()
+        elapsed = None if execution.started_at == None else finished_at - execution.started_at
+        with self.__lock, self.__db:
+            self.__db.execute("INSERT INTO executions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (
+                execution.target.rel_path, execution.execution_id, execution.account, execution.status,
+                execution.started_at, finished_at, elapsed, execution.duration,
+                execution.total, execution.passes, execution.warns, execution.fails))
+
+    def history(self, rel_paths = None):
+        """ Return the elapsed times (in seconds) of the most recent HISTORY executions per relative path, oldest first.
+            If rel_paths is provided, only these paths are returned. """
+        with self.__lock:
+            rows = self.__db.execute("SELECT rel_path, elapsed FROM executions WHERE elapsed IS NOT NULL ORDER BY finished_at DESC").fetchall()
+        history = {}
+        for rel_path, elapsed in rows:
+            if rel_paths != None and rel_path not in rel_paths:
+                continue
+            elapsed_times = history.setdefault(rel_path, [])
+            if len(elapsed_times) < self.HISTORY:
+                elapsed_times.insert(0, elapsed)
+        return history
+
+    def expectedDurations(self, rel_paths = None):
+        """ Return the median elapsed time (in seconds) per relative path, based on the recent history. """
+        return {rel_path: statistics.median(times) for rel_path, times in self.history(rel_paths).items()}
+
+    def regressions(self, executions, history):
+        """ Return (execution, elapsed, median) for the finished executions that took substantially longer than the
+            historical median. The history should be taken from history() before the executions were recorded. """
+        result = []
+        for execution in executions:
+            times = history.get(execution.target.rel_path, [])
+            if execution.finished_at == None or execution.started_at == None or len(times) < self.MIN_HISTORY:
+                continue
+            elapsed = execution.finished_at - execution.started_at
+            median = statistics.median(times)
+            if elapsed > median * self.REGRESSION_FACTOR and elapsed - median > self.REGRESSION_MARGIN:
+                result.append((execution, elapsed, median))
+        return result
+
+    def close(self):
+        with self.__lock:
+            self.__db.close()
@@ -0,0 +1,100 @@
+""" Sinks that write the results of Touchstone executions to machine-readable files the moment each execution
+    finishes, so CI can report on them while the remaining executions are still running. A sink is a callable that
+    is added to Touchstone.listeners. """
+
+import datetime
+import json
+import os
+import pathlib
+import threading
+import xml.etree.ElementTree as ET
+
+def executionRecord(execution):
+    """ Return the results of an Execution as a plain dict. """
+    record = {
+        "rel_path": execution.target.rel_path,
+        "execution_id": execution.execution_id,
+        "url": execution.url,
+        "account": execution.account,
+        "sequence": execution.sequence,
+        "status": execution.status,
+        "total": execution.total,
+        "passes": execution.passes,
+        "warns": execution.warns,
+        "fails": execution.fails,
+        "not_started": max(execution.total - execution.passes - execution.warns - execution.fails, 0),
+        "duration": execution.duration,
+        "started_at": None,
+        "finished_at": None,
+        "elapsed": None
+    }
+    if execution.started_at != None:
+        record["started_at"] = datetime.datetime.fromtimestamp(execution.started_at).isoformat(timespec = "seconds")
+    if execution.finished_at != None:
+        record["finished_at"] = datetime.datetime.fromtimestamp(execution.finished_at).isoformat(timespec = "seconds")
+        if execution.started_at != None:
+            record["elapsed"] = round(execution.finished_at - execution.started_at, 1)
+    return record
+
+class JsonLinesSink:
+    """ Append one JSON object per finished execution to a JSON Lines file. The file is flushed after every line. """
+    def __init__(self, path):
+        self.__file = open(path, "a", encoding = "utf-8")
+        self.__lock = threading.Lock()
+
+    def __call__(self, execution):
+        line = json.dumps(executionRecord(execution), ensure_ascii = False)
+        with self.__lock:
+            self.__file.write(line + "\n")
+            self.__file.flush()
+
+    def close(self):
+        self.__file.close()
+
+class JUnitSink:
+    """ Write the finished executions as a JUnit XML report, with one testcase per execution in the order in which
+        the executions were started. The report is rewritten after every execution, so that it's always a complete
+        document with all results so far. """
+    def __init__(self, path, suite_name = "Touchstone"):
+        self.path = pathlib.Path(path)
+        self.suite_name = suite_name
+        self.__records = []
+        self.__lock = threading.Lock()
+        self.__write()
+
+    def __call__(self, execution):
+        with self.__lock:
+            self.__records.append(executionRecord(execution))
+            self.__write()
+
+    def __write(self):
+        suite = ET.Element("testsuite", {
+            "name": self.suite_name,
+            "tests": str(len(self.__records)),
+            "failures": str(sum(1 for r in self.__records if r["status"] not in ["Passed", "Unknown"])),
+            "errors": str(sum(1 for r in self.__records if r["status"] == "Unknown")),
+            "time": str(round(sum(r["elapsed"] or 0 for r in self.__records), 1))
+        })
+        for record in sorted(self.__records, key = lambda r: r["sequence"] or 0):
+            classname, _, name = record["rel_path"].rpartition("/")
+            testcase = ET.SubElement(suite, "testcase", {
+                "classname": classname.replace("/", "."),
+                "name": name,
+                "time": str(record["elapsed"] or 0)
+            })
+            summary = f"{record['passes']} passed, {record['warns']} passed with warnings, {record['fails']} failed"
+            if record["not_started"] > 0:
+                summary += f", {record['not_started']} never started"
+            if record["status"] == "Unknown":
+                ET.SubElement(testcase, "error", {"message": "Status couldn't be retrieved"})
+            elif record["status"] != "Passed":
+                failure = ET.SubElement(testcase, "failure", {"message": f"{record['status']}: {summary}"})
+                failure.text = record["url"]
+            ET.SubElement(testcase, "system-out").text = f"{summary}\n{record['url']}"
+
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        ET.ElementTree(suite).write(tmp_path, encoding = "utf-8", xml_declaration = True)
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        pass
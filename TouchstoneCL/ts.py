@@ -1,22 +1,33 @@
 #!/usr/bin/env python3
 
 import argparse
-import collections
+import bisect
+import concurrent.futures
 import datetime
-import enum
+import fnmatch
+import hashlib
+import json
 import mechanicalsoup
 import os
 import pathlib
+import queue
 import re
 import requests
-import shutil
+import subprocess
 import sys
 import tempfile
+import threading
 import time
+import urllib3
 import yaml
+import zipfile
 
 from colorama import just_fix_windows_console
-from dataclasses import dataclass
+from dashboard import StatusDashboard
+from dataclasses import dataclass, field
+from journal import ExecutionJournal
+from metrics import MetricsStore
+from results import JsonLinesSink, JUnitSink
 
 class ExecutionTarget:
     """
@@ -82,6 +93,144 @@ class UploadTarget:
     def setAccess(self, access):
         self.access = [access] if type(access) == str else access
 
+class RequestBudget:
+    """ Token bucket to limit the rate of requests that is sent to Touchstone, shared by all threads that use it.
+        * rate: the number of requests per second that can be sustained.
+        * burst: the number of requests that can be sent at once after a period of inactivity.
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.__tokens = burst
+        self.__updated_at = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def acquire(self):
+        """ Block until a request may be sent. """
+        while True:
+            with self.__lock:
+                now = time.monotonic()
+                self.__tokens = min(self.burst, self.__tokens + (now - self.__updated_at) * self.rate)
+                self.__updated_at = now
+                if self.__tokens >= 1:
+                    self.__tokens -= 1
+                    return
+                wait = (1 - self.__tokens) / self.rate
+            time.sleep(wait)
+
+class UploadManifest:
+    """ Local record of the folders that have been uploaded successfully, so unchanged folders can be skipped. For each
+        UploadTarget (identified by kind and rel_path) it stores a Merkle-style hash of the folder content, where the
+        hash of a folder is computed from the names, sizes and modification times of its files and the hashes of its
+        subfolders, together with the access and validator settings used for the upload. If force is set to True, all
+        targets are considered to be changed, but successful uploads are still recorded. """
+
+    def __init__(self, path, force = False):
+        self.path = pathlib.Path(path)
+        self.force = force
+        self.__entries = {}
+        if self.path.exists():
+            with open(self.path, "r") as f:
+                self.__entries = json.load(f)
+        self.__tree_hashes = {} # Folder hashes computed during this run, shared between overlapping targets
+        self.__lock = threading.Lock()
+
+    def hash(self, target: UploadTarget):
+        """ Return the hash of the content and upload settings of a target. """
+        content = self.__treeHash(target.path, target.kind == "dev")
+        settings = json.dumps({"access": sorted(target.access or []), "validator": target.validator})
+        return hashlib.sha256((content + settings).encode()).hexdigest()
+
+    def __treeHash(self, path, skip_group_props):
+        """ Return the hash of a folder, based on the file stats rather than the file content. groupProps.json is
+            left out if skip_group_props is True, like it is for dev uploads. """
+        key = (path, skip_group_props)
+        with self.__lock:
+            if key in self.__tree_hashes:
+                return self.__tree_hashes[key]
+
+        digest = hashlib.sha256()
+        for child in sorted(path.iterdir()):
+            if child.is_dir():
+                digest.update(f"d {child.name} {self.__treeHash(child, skip_group_props)}\n".encode())
+            elif not (skip_group_props and child.name == "groupProps.json"):
+                stat = child.stat()
+                digest.update(f"f {child.name} {stat.st_size} {stat.st_mtime_ns}\n".encode())
+
+        with self.__lock:
+            self.__tree_hashes[key] = digest.hexdigest()
+        return self.__tree_hashes[key]
+
+    def isUnchanged(self, target: UploadTarget):
+        """ Return True if the target has been uploaded before with exactly the same content and settings. """
+        return not self.force and self.__entries.get(f"{target.kind}:{target.rel_path}") == self.hash(target)
+
+    def record(self, target: UploadTarget):
+        """ Register a successful upload of the target and write the manifest to disk. As uploading a folder replaces
+            its subfolders on Touchstone, using the settings of the folder, the entries of its subfolders are dropped. """
+        target_hash = self.hash(target)
+        key = f"{target.kind}:{target.rel_path}"
+        with self.__lock:
+            for descendant in [k for k in self.__entries if k.startswith(key + "/")]:
+                del self.__entries[descendant]
+            self.__entries[key] = target_hash
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(self.__entries, f, indent = 2, sort_keys = True)
+            os.replace(tmp_path, self.path)
+
+class SetupForm:
+    """ Index of the fields on the test setup page of Touchstone, built in a single pass over the page. The fields
+        can then be manipulated directly, instead of searching the page for every field that should be set.
+        * textareas: all textareas on the page.
+        * variables: the textareas for the TestScript variables, by variable name. The name attribute of these
+                     textareas is very long and it's not guaranteed that the beginning is stable, so the variable name is
+                     taken from the latter part of the name.
+        * selects: all select boxes, by id.
+        * defaults: the hidden inputs containing the default values for the variables.
+    """
+    VARIABLE_NAME = re.compile(r"variableSetups\.variableSetupMap\[(.+)\]$")
+
+    def __init__(self, page):
+        self.textareas = []
+        self.variables = {}
+        self.selects = {}
+        self.defaults = []
+        for tag in page.find_all(["textarea", "select", "input"]):
+            if tag.name == "textarea":
+                self.textareas.append(tag)
+                match = SetupForm.VARIABLE_NAME.search(tag.attrs.get("name", ""))
+                if match:
+                    self.variables.setdefault(match.group(1), []).append(tag)
+            elif tag.name == "select":
+                if "id" in tag.attrs:
+                    self.selects[tag.attrs["id"]] = tag
+            elif "ud_defaults" in tag.attrs.get("class", []):
+                self.defaults.append(tag)
+
+    def setVariable(self, name, value):
+        for textarea in self.variables.get(name, []):
+            textarea.string = value
+
+    def stripTextareas(self):
+        for textarea in self.textareas:
+            textarea.string = textarea.text.strip()
+
+    def removeDefaults(self):
+        for input in self.defaults:
+            input.extract()
+
+class ArchiveFile(tempfile.SpooledTemporaryFile):
+    """ Zip archive for uploading, which is kept in memory until it exceeds max_size bytes and is spooled to disk
+        after that. The name is used as the file name for the upload. """
+    def __init__(self, name, max_size):
+        super().__init__(max_size = max_size)
+        self.__name = name
+
+    @property
+    def name(self):
+        return self.__name
+
 @dataclass
 class Execution:
     target: ExecutionTarget
@@ -92,13 +241,55 @@ class Execution:
     warns: int =  0
     fails: int =  0
     duration: str = ""
+    url: str = ""
+    account: str = ""            # The user name of the account that started the execution
+    sequence: int = None         # Position of the execution in the order in which the executions were started
+    started_at: float = field(default_factory = time.time)
+    finished_at: float = None
+    next_poll_at: float = 0      # Time (on the time.monotonic() clock) when the status should be refreshed again
+    poll_interval: float = None
+    first_seen: tuple = None     # Time and number of completed tests when the status was first retrieved
     
+class PropertyTree:
+    """ Tree of the properties defined in the properties file, following the folder structure. Looking up the
+        properties for a folder only visits the nodes on its path, so it's O(depth). """
+    def __init__(self):
+        self.children = {}
+        self.properties = None
+
+    def insert(self, parts, properties):
+        node = self
+        for part in parts:
+            node = node.children.setdefault(part, PropertyTree())
+        node.properties = properties
+
+    def lookup(self, parts):
+        """ Return the properties that apply to the folder with the provided path parts, sorted from fine to coarse so
+            that the first match can be used as the most precise specification for that folder. """
+        matches = []
+        node = self
+        if node.properties != None:
+            matches.append(node.properties)
+        for part in parts:
+            node = node.children.get(part)
+            if node == None:
+                break
+            if node.properties != None:
+                matches.append(node.properties)
+        matches.reverse()
+        return matches
+
 class KnownTargets:
     """ Class to translate the file tree in the testscripts repo to Upload/ExecutionTarget's, based on the properties
-        defined in a properties yaml file. """
-    def __init__(self, root, properties_file):
+        defined in a properties yaml file. As scanning the full repo takes some time, the list of folders is cached in
+        index_file; this cache is invalidated when the modification time of any of the scanned folders changes. """
+    def __init__(self, root, properties_file, index_file = ".known-targets.json"):
         self.root = pathlib.Path(root) / "dev"
-        self.dirs = self.__getRecursiveDirs([], self.root)
+        self.index_file = pathlib.Path(index_file) if index_file else None
+        self.dirs = self.__loadIndex()
+        if self.dirs == None:
+            self.dirs = self.__scan()
+        self.__buildNameIndex()
         self.properties_dev, self.properties_prod = self.loadProperties(properties_file)
 
     def list(self, exclude_reference = False):
@@ -110,45 +301,169 @@ class KnownTargets:
                 print(f"{i}. {dir.relative_to(self.root)}")
             i += 1
 
-    def __getRecursiveDirs(self, curr_list, curr_dir):
-        """ Helper method to scan the target folder recursively. """
-        for dir in curr_dir.iterdir():
+    def __getRecursiveDirs(self, curr_list, curr_dir, scanned):
+        """ Helper method to scan the target folder recursively. The folders that have been descended into are added
+            to scanned, together with their modification time. """
+        scanned[curr_dir.relative_to(self.root).as_posix()] = curr_dir.stat().st_mtime_ns
+        for dir in sorted(curr_dir.iterdir()):
             if dir.is_dir():
                 if dir.name == "_reference": # Don't descend into _reference
                     curr_list.append(dir)
                 elif not dir.name.startswith("."):
                     curr_list.append(dir)
-                    curr_list = self.__getRecursiveDirs(curr_list, dir)
+                    curr_list = self.__getRecursiveDirs(curr_list, dir, scanned)
 
         return curr_list
 
-    def get(self, arg):
-        """ Return the path corresponding to the number shown by list(). """
+    def __scan(self):
+        """ Scan the repo for target folders and store the result in the index file. """
+        scanned = {}
+        dirs = self.__getRecursiveDirs([], self.root, scanned)
+        if self.index_file != None:
+            index = {
+                "root": str(self.root.resolve()),
+                "dirs": [dir.relative_to(self.root).as_posix() for dir in dirs],
+                "mtimes": scanned
+            }
+            try:
+                with open(self.index_file, "w") as f:
+                    json.dump(index, f)
+            except OSError as e:
+                print(f"Couldn't write index file {self.index_file}: {e}")
+        return dirs
+
+    def __loadIndex(self):
+        """ Return the list of target folders from the index file, or None if it's absent or outdated. """
+        if self.index_file == None or not self.index_file.exists():
+            return None
+        try:
+            with open(self.index_file, "r") as f:
+                index = json.load(f)
+            if index["root"] != str(self.root.resolve()):
+                return None
+            for rel_path, mtime in index["mtimes"].items():
+                if (self.root / rel_path).stat().st_mtime_ns != mtime:
+                    return None
+        except (OSError, ValueError, KeyError):
+            return None
+        return [self.root / rel_path for rel_path in index["dirs"]]
+
+    def __buildNameIndex(self):
+        """ Build the indices used for resolving targets by name: the (lowercase) relative paths, all their trailing
+            parts for mnemonics, and a sorted list of the relative paths for prefix searches. """
+        self.__rel_paths = [dir.relative_to(self.root).as_posix() for dir in self.dirs]
+        self.__by_path = {}
+        self.__by_suffix = {}
+        for i in range(len(self.dirs)):
+            rel_path = self.__rel_paths[i].lower()
+            self.__by_path[rel_path] = i
+            parts = rel_path.split("/")
+            for j in range(1, len(parts)):
+                self.__by_suffix.setdefault("/".join(parts[j:]), []).append(i)
+        self.__sorted_paths = sorted((rel_path.lower(), i) for i, rel_path in enumerate(self.__rel_paths))
+
+    def __prefixRange(self, prefix):
+        """ Return the indices of all directories whose relative path starts with prefix (lowercase). """
+        start = bisect.bisect_left(self.__sorted_paths, (prefix, -1))
+        end = bisect.bisect_left(self.__sorted_paths, (prefix + "\uffff", -1))
+        return [i for _, i in self.__sorted_paths[start:end]]
+
+    def __resolve(self, arg, exclude_reference):
+        """ Return the indices of the directories matching a single target specification, sorted in listing order.
+            The specification can be:
+            * the number shown by list()
+            * the relative path of a directory (optionally prefixed with "dev/")
+            * a glob pattern on the relative path, where "*" doesn't match across folders and "**" matches any number
+              of folders, e.g. "FHIR3-0-2-Geboortezorg/*/Cert"
+            * a mnemonic, which is either the last folder name(s) of the relative path or the start of the relative
+              path (e.g. "FHIR3-0-2-Geb"), as long as it points to a single directory
+        """
         try:
             index = int(arg)
-            return self.dirs[index - 1]
+            if index < 1 or index > len(self.dirs):
+                raise Exception(f"No such target: {arg}")
+            return [index - 1]
         except ValueError:
-            raise Exception(f"No such target: {arg}")
+            pass
+
+        spec = arg.strip("/").lower()
+        if spec.startswith("dev/"):
+            spec = spec[4:]
+        if spec in self.__by_path:
+            return [self.__by_path[spec]]
+
+        if any(c in spec for c in "*?["):
+            parts = spec.split("/")
+            literal = []
+            for part in parts:
+                if any(c in part for c in "*?["):
+                    break
+                literal.append(part)
+            prefix = "/".join(literal) + "/" if len(literal) > 0 else ""
+            matches = [i for i in self.__prefixRange(prefix) if KnownTargets.__globMatch(parts, self.__rel_paths[i].lower().split("/"))]
+            if exclude_reference:
+                matches = [i for i in matches if self.dirs[i].name != "_reference"]
+            return sorted(matches)
+
+        if spec in self.__by_suffix:
+            matches = self.__by_suffix[spec]
+            if len(matches) > 1:
+                raise Exception(f"Target '{arg}' is ambiguous, it could be any of: " + ", ".join(self.__rel_paths[i] for i in matches))
+            return list(matches)
+
+        matches = self.__prefixRange(spec)
+        if len(matches) > 0:
+            shortest = min(matches, key = lambda i: len(self.__rel_paths[i]))
+            if all(i == shortest or self.__rel_paths[i].startswith(self.__rel_paths[shortest] + "/") for i in matches):
+                return [shortest]
+            raise Exception(f"Target '{arg}' is ambiguous, it could be any of: " + ", ".join(self.__rel_paths[i] for i in matches))
+
+        raise Exception(f"No such target: {arg}")
+
+    @staticmethod
+    def __globMatch(pattern_parts, path_parts):
+        """ Match the parts of a path to the parts of a glob pattern, where "**" matches zero or more parts. """
+        if len(pattern_parts) == 0:
+            return len(path_parts) == 0
+        if pattern_parts[0] == "**":
+            return any(KnownTargets.__globMatch(pattern_parts[1:], path_parts[i:]) for i in range(len(path_parts) + 1))
+        if len(path_parts) == 0 or not fnmatch.fnmatchcase(path_parts[0], pattern_parts[0]):
+            return False
+        return KnownTargets.__globMatch(pattern_parts[1:], path_parts[1:])
+
+    def resolve(self, args, exclude_reference = False):
+        """ Return the directories for a list of target specifications (see __resolve()), in the order in which they
+            are specified and without duplicates. Directories matching a single glob pattern are returned in listing
+            order. If exclude_reference is set to True, _reference folders are left out of glob matches. """
+        indices = []
+        for arg in args:
+            for i in self.__resolve(arg, exclude_reference):
+                if i not in indices:
+                    indices.append(i)
+        return [self.dirs[i] for i in indices]
+
+    def get(self, arg):
+        """ Return the path corresponding to a single target specification, which can be the number shown by list()
+            or a relative path or mnemonic (see __resolve()). A path that is already resolved is returned as-is. """
+        if isinstance(arg, pathlib.Path):
+            return arg
+        dirs = self.resolve([arg])
+        if len(dirs) != 1:
+            raise Exception(f"Target '{arg}' doesn't point to a single folder")
+        return dirs[0]
 
     def loadProperties(self, properties_file):
-        """ Load the properties file and return the result in two dictionaries: one for the dev environment, and one
-            for the production environment. The dicts are actually OrderedDicts where the keys are base folders
-            containing a particular set of settings. These keys are sorted from fine to course, so that the first match
-            can be used as the most precise specification for that folder. """
+        """ Load the properties file and return the result in two PropertyTrees: one for the dev environment, and one
+            for the production environment. """
         with open(properties_file, "r") as f:
             raw = yaml.safe_load(f)
         
-        _dev_properties = self.__walkProperties({}, self.root, raw["dev"])
-        _prod_properties = self.__walkProperties({}, self.root, raw["production"])
-
-        _dev_keys = sorted(_dev_properties.keys(), reverse=True)
-        _prod_keys = sorted(_prod_properties.keys(), reverse=True)
-        dev_properties = collections.OrderedDict()
-        prod_properties = collections.OrderedDict()
-        for key in _dev_keys:
-            dev_properties[key] = _dev_properties[key]
-        for key in _prod_keys:
-            prod_properties[key] = _prod_properties[key]
+        dev_properties = PropertyTree()
+        prod_properties = PropertyTree()
+        for path, properties in self.__walkProperties({}, self.root, raw["dev"]).items():
+            dev_properties.insert(path.relative_to(self.root).parts, properties)
+        for path, properties in self.__walkProperties({}, self.root, raw["production"]).items():
+            prod_properties.insert(path.relative_to(self.root).parts, properties)
         
         return dev_properties, prod_properties
 
@@ -164,9 +479,13 @@ class KnownTargets:
         
         return properties
 
+    def getUploadTargets(self, args, kind):
+        """ Return the UploadTargets for a list of target specifications (see resolve()). """
+        return [self.getUploadTarget(dir, kind) for dir in self.resolve(args)]
+
     def getUploadTarget(self, target, kind):
         """ Return the parameters needed for uploading the target, where target is the index number of
-            KnownTargets. """
+            KnownTargets, or any other specification supported by get(). """
         dir = self.get(target)
 
         rel_path = dir.relative_to(self.root).as_posix()
@@ -175,12 +494,11 @@ class KnownTargets:
         target = UploadTarget(dir, rel_path, kind)
 
         properties = self.properties_dev if kind == "dev" else self.properties_prod
-        for root in properties.keys():
-            if dir == root or root in dir.parents:
-                if not target.hasAccess() and "access" in properties[root]:
-                    target.setAccess(properties[root]["access"])
-                if not target.validator and "validator" in properties[root]:
-                    target.validator = properties[root]["validator"]
+        for props in properties.lookup(dir.relative_to(self.root).parts):
+            if not target.hasAccess() and "access" in props:
+                target.setAccess(props["access"])
+            if not target.validator and "validator" in props:
+                target.validator = props["validator"]
             if target.hasAccess() and target.validator:
                 return target
         
@@ -189,9 +507,58 @@ class KnownTargets:
         if target.validator == None:
             raise Exception(f"Couldn't find a validator in the properties file for {target.rel_path}")
 
+    def getExecutionTargets(self, args, kind):
+        """ Return the ExecutionTargets for a list of target specifications (see resolve()), in the order in which the
+            ExecutionScheduler will run them. _reference folders are excluded from glob patterns. """
+        targets = [self.getExecutionTarget(dir, kind) for dir in self.resolve(args, exclude_reference = True)]
+        return ExecutionScheduler.order(targets)
+
+    def changedDirs(self, revision_range):
+        """ Return the target folders that are affected by the changes in the testscripts repo for a git revision range
+            (anything accepted by git diff, e.g. "main..HEAD", or "HEAD~3" to include uncommitted changes). Each changed
+            file is mapped to the deepest known folder containing it. Changes to a _reference folder are mapped to its
+            parent folder, which contains the tests using it. Changes outside of any target folder are ignored. """
+        result = subprocess.run(["git", "-C", str(self.root), "diff", "--name-only", "--relative", revision_range, "--"],
+                                capture_output = True, text = True)
+        if result.returncode != 0:
+            raise Exception(f"Couldn't get the changes for '{revision_range}': {result.stderr.strip()}")
+
+        indices = []
+        for file in result.stdout.splitlines():
+            parts = file.strip().lower().split("/")[:-1]
+            for depth in range(len(parts), 0, -1):
+                rel_path = "/".join(parts[:depth])
+                if rel_path in self.__by_path:
+                    if self.dirs[self.__by_path[rel_path]].name == "_reference":
+                        rel_path = "/".join(parts[:depth - 1])
+                    if rel_path in self.__by_path and self.__by_path[rel_path] not in indices:
+                        indices.append(self.__by_path[rel_path])
+                    break
+        return [self.dirs[i] for i in sorted(indices)]
+
+    def getChangedExecutionTargets(self, revision_range, kind):
+        """ Return the ExecutionTargets affected by the changes for a git revision range (see changedDirs()), in the
+            order in which the ExecutionScheduler will run them. The _LoadResources targets that the affected targets
+            have to wait for are included as well. """
+        dirs = self.changedDirs(revision_range)
+        targets = [self.getExecutionTarget(dir, kind) for dir in dirs]
+        selected = set(t.rel_path for t in targets)
+
+        for dir, target in list(zip(dirs, targets)):
+            parts = dir.relative_to(self.root).parts
+            for depth in range(len(parts), -1, -1):
+                rel_path = "/".join(parts[:depth] + ("_LoadResources",)).lower()
+                if rel_path not in self.__by_path:
+                    continue
+                loadscript = self.getExecutionTarget(self.dirs[self.__by_path[rel_path]], kind)
+                if loadscript.rel_path not in selected and ExecutionScheduler.blocks(loadscript, target):
+                    targets.append(loadscript)
+                    selected.add(loadscript.rel_path)
+        return ExecutionScheduler.order(targets)
+
     def getExecutionTarget(self, target, kind):
         """ Return the parameters needed for executing the target, where target is the index number of
-            KnownTargets. """
+            KnownTargets, or any other specification supported by get(). """
         dir = self.get(target)
 
         rel_path = dir.relative_to(self.root).as_posix()
@@ -201,16 +568,15 @@ class KnownTargets:
         target.setLoadScriptFolder(dir.name == "_LoadResources")
 
         properties = self.properties_dev if kind == "dev" else self.properties_prod
-        for root in properties.keys():
-            if dir == root or root in dir.parents:
-                if not target.hasOrigins() and "origins" in properties[root]:
-                    target.setOrigins(properties[root]["origins"])
-                if not target.hasDestinations() and "destinations" in properties[root]:
-                    target.setDestinations(properties[root]["destinations"])
-                if "params" in properties[root]:
-                    target.params = target.params | properties[root]["params"]
-                if target.block_until_complete == None and "block until complete" in properties[root]:
-                    target.block_until_complete = properties[root]["block until complete"]
+        for props in properties.lookup(dir.relative_to(self.root).parts):
+            if not target.hasOrigins() and "origins" in props:
+                target.setOrigins(props["origins"])
+            if not target.hasDestinations() and "destinations" in props:
+                target.setDestinations(props["destinations"])
+            if "params" in props:
+                target.params = target.params | props["params"]
+            if target.block_until_complete == None and "block until complete" in props:
+                target.block_until_complete = props["block until complete"]
         
         if not target.hasOrigins():
             raise Exception(f"Couldn't get the origin(s) from the properties file for {target.rel_path}")
@@ -218,43 +584,232 @@ class KnownTargets:
             raise Exception(f"Couldn't get the destination(s) from the properties file for {target.rel_path}")
         return target
 
-class Touchstone(mechanicalsoup.StatefulBrowser):
-    MAX_PARALLEL_EXECUTIONS = 4
+class ExecutionScheduler:
+    """ Work queue for ExecutionTargets. A target is started as soon as an execution slot is free and all targets it
+        depends on have completed. A target depends on an earlier target that should block until complete; for a
+        _LoadResources target this only applies to the targets in the folder it loads the resources for, other blocking
+        targets hold back all targets that come after it.
+        If the expected durations of the targets are known, the longest target that can be started goes first (after
+        the targets that other targets are waiting for), which shortens the total time needed to run all targets. """
+
+    def __init__(self, targets, max_parallel, durations = None):
+        self.queue = ExecutionScheduler.order(targets)
+        self.slots = threading.BoundedSemaphore(max_parallel)
+        self.durations = durations # Expected duration in seconds per relative path
+        self.__default_duration = sum(durations.values()) / len(durations) if durations else 0 # For unknown targets
+        self.__dependencies = {}
+        for i in range(len(self.queue)):
+            target = self.queue[i]
+            self.__dependencies[target] = [t for t in self.queue[:i] if ExecutionScheduler.blocks(t, target)]
+        self.__running = []     # Executions that are running
+        self.__slotted = []     # Running executions that occupy an execution slot
+        self.__finished = set() # Targets that have completed (or that couldn't be started)
+
+    @staticmethod
+    def order(targets):
+        """ Return the targets in the order they will be run: the order in which they are provided, except that
+            _LoadResources targets are moved in front of the first target they load the resources for. """
+        ordered = list(targets)
+        for target in [t for t in targets if t.is_loadscript_folder]:
+            scope = ExecutionScheduler.scope(target)
+            first = next(i for i in range(len(ordered)) if ordered[i] is target or ExecutionScheduler.inScope(ordered[i], scope))
+            ordered.remove(target)
+            ordered.insert(first, target)
+        return ordered
+
+    @staticmethod
+    def scope(target):
+        """ Return the relative path of the folder where a target applies to, which is the parent folder for a
+            _LoadResources target. """
+        if target.is_loadscript_folder:
+            return "/".join(target.rel_path.split("/")[:-1])
+        return target.rel_path
+
+    @staticmethod
+    def inScope(target, scope):
+        return scope == "" or target.rel_path == scope or target.rel_path.startswith(scope + "/")
+
+    @staticmethod
+    def blocks(blocker, target):
+        """ Return True if target has to wait for blocker to complete, assuming blocker is run earlier. """
+        if not blocker.block_until_complete:
+            return False
+        if blocker.is_loadscript_folder:
+            return ExecutionScheduler.inScope(target, ExecutionScheduler.scope(blocker))
+        return True
+
+    def hasPending(self):
+        return len(self.queue) > 0
+
+    def update(self):
+        """ Release the execution slots of all executions that are no longer running. """
+        for execution in [e for e in self.__running if e.status not in ["Running", ""]]:
+            self.__running.remove(execution)
+            self.__finished.add(execution.target)
+            if execution in self.__slotted:
+                self.__slotted.remove(execution)
+                self.slots.release()
+
+    def __eligible(self):
+        """ Return the next target in the queue for which all dependencies have completed, or None. This is the first
+            one in the queue, unless the expected durations are known: then the blocking targets go first, followed by
+            the target with the longest expected duration. """
+        eligible = (t for t in self.queue if all(t in self.__finished for t in self.__dependencies[t]))
+        if not self.durations:
+            return next(eligible, None)
+        return max(eligible, key = lambda t: (t.block_until_complete == True, self.durations.get(t.rel_path, self.__default_duration)), default = None)
+
+    def ready(self):
+        """ Return True if the next target can be started right away, or if waiting won't change anything because no
+            execution is running anymore. """
+        self.update()
+        if len(self.__running) == 0:
+            return True
+        if self.__eligible() is None or not self.slots.acquire(blocking = False):
+            return False
+        self.slots.release()
+        return True
+
+    def next(self):
+        """ Return the next target that can be started right away and claim an execution slot for it, or None if
+            there's no such target. """
+        self.update()
+        target = self.__eligible()
+        if target is None or not self.slots.acquire(blocking = False):
+            return None
+        self.queue.remove(target)
+        return target
 
-    """ Enum for the different things we can wait for. """
-    class AwaitMode(enum.Enum):
-        ALL      = 0   # Await until all executions have finished
-        BLOCKING = 1   # Await only until all executions marked "blocking" have finished
-        MAX      = 2   # Await until the number of parallel executions is below MAX_PARLLEL_EXECUTIONS
+    def started(self, target, execution):
+        """ Register the Execution for a target returned by next(), or None if it couldn't be started. """
+        if execution is None:
+            self.__finished.add(target)
+            self.slots.release()
+        else:
+            self.__running.append(execution)
+            self.__slotted.append(execution)
+
+    def adopt(self, execution):
+        """ Register an execution that is still running but that was started outside of this scheduler, e.g. in a
+            previous session. If its target is in the queue, it is taken out, and targets depending on it will wait for
+            the execution to complete. The execution occupies an execution slot if one is available. """
+        for target in self.queue:
+            if target.rel_path == execution.target.rel_path:
+                self.queue.remove(target)
+                execution.target = target
+                break
+        self.__running.append(execution)
+        if self.slots.acquire(blocking = False):
+            self.__slotted.append(execution)
 
-    def __init__(self):
+class Touchstone(mechanicalsoup.StatefulBrowser):
+    BASE_URL                = "https://touchstone.aegis.net/touchstone"
+    MAX_PARALLEL_EXECUTIONS = 4    # Number of executions that can run at the same time for a single user
+    MIN_POLL_INTERVAL       = 4    # Minimal number of seconds between two status refreshes of an execution
+    MAX_POLL_INTERVAL       = 30   # Maximal number of seconds between two status refreshes of an execution
+    SLOT_POLL_INTERVAL      = 8    # Idem, while a target is waiting for an execution slot or a blocking execution
+    POLL_BACKOFF            = 1.5  # Factor to increase the poll interval with when an execution doesn't progress
+    POLL_WORKERS            = 16   # Number of status requests that can be in flight at the same time
+    POOL_SIZE               = 16   # Number of keep-alive connections to Touchstone
+    HTTP_RETRIES            = 3    # Number of retries for failed idempotent requests
+    HTTP_BACKOFF            = 0.5  # Backoff factor (in seconds) between retries
+    PARALLEL_UPLOADS        = 4    # Number of concurrent uploads (each using its own login)
+    ARCHIVE_SPOOL_SIZE      = 64 * 1024 * 1024 # Size above which the zip for an upload is moved from memory to disk
+    GROUP_ROOT              = "/FHIRSandbox/Nictiz" # Path of the test group where all targets live in
+    API_REQUESTS_PER_SECOND = 8    # Request budget for the Touchstone API, shared by all polling threads and accounts
+    API_REQUEST_BURST       = 32
+
+    def __init__(self, base_url = None, user = None, password = None, api_budget = None):
         super().__init__()
 
         just_fix_windows_console()
 
+        self.base_url = base_url or self.BASE_URL
+
         # Default to this monday
         monday = datetime.date.today() - datetime.timedelta(days = datetime.date.today().weekday())
         self.date_T = monday.strftime("%Y-%m-%d")
 
-        if not ("TS_USER"  in os.environ and "TS_PASS" in os.environ):
-            sys.exit("Set the environment variables 'TS_USER' and 'TS_PASS' to login to Touchstone")
+        if user == None:
+            if not ("TS_USER"  in os.environ and "TS_PASS" in os.environ):
+                sys.exit("Set the environment variables 'TS_USER' and 'TS_PASS' to login to Touchstone")
+            user, password = os.environ["TS_USER"], os.environ["TS_PASS"]
+        self.user = user
+        self.password = password
 
+        self.accounts = [self] # The sessions used for starting executions, see addAccounts()
         self.executions = []
+        self.start_listeners = [] # Functions that are called with each Execution as soon as it has been started
+        self.listeners = [] # Functions that are called with each Execution as soon as it has finished
         self.__api_key = None
 
+        # The frontend and the API calls share the session of the browser, which keeps its connections alive. Status
+        # polling is done concurrently over this session, limited by a global request budget rather than a fixed
+        # pause per request. Sessions for additional accounts share the budget of the primary session (see
+        # addAccounts()), and their executions are polled by the threads of the primary session.
+        self.setPoolSize(self.POOL_SIZE)
+        if api_budget == None:
+            self.__api_budget = RequestBudget(self.API_REQUESTS_PER_SECOND, self.API_REQUEST_BURST)
+            self.__poll_pool = concurrent.futures.ThreadPoolExecutor(max_workers = self.POLL_WORKERS)
+        else:
+            self.__api_budget = api_budget
+            self.__poll_pool = None
+
+    def setPoolSize(self, pool_size):
+        """ (Re)configure the connection pool of the session that is used for both the frontend and the API. Only
+            idempotent requests are retried, so we'll never submit a form twice. When the retries are exhausted, the
+            last response is returned rather than raising an exception. """
+        retries = urllib3.util.Retry(total = self.HTTP_RETRIES, backoff_factor = self.HTTP_BACKOFF,
+                                     status_forcelist = [429, 500, 502, 503, 504], allowed_methods = ["HEAD", "GET"],
+                                     raise_on_status = False)
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize = pool_size, max_retries = retries)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    @staticmethod
+    def credentials():
+        """ Return the user names and passwords of all accounts that are available in the environment: TS_USER and
+            TS_PASS, followed by TS_USER_1 and TS_PASS_1, TS_USER_2 and TS_PASS_2, etc. """
+        credentials = []
+        if "TS_USER" in os.environ and "TS_PASS" in os.environ:
+            credentials.append((os.environ["TS_USER"], os.environ["TS_PASS"]))
+        i = 1
+        while f"TS_USER_{i}" in os.environ and f"TS_PASS_{i}" in os.environ:
+            credentials.append((os.environ[f"TS_USER_{i}"], os.environ[f"TS_PASS_{i}"]))
+            i += 1
+        return credentials
+
+    def addAccounts(self, credentials):
+        """ Add sessions for additional accounts, provided as (user, password) tuples, to spread executions over. Each
+            account can run MAX_PARALLEL_EXECUTIONS executions at the same time. The executions and listeners are shared
+            with this session, so the results of all accounts end up in a single report. The request budget is shared
+            as well, so adding accounts doesn't increase the load on Touchstone. """
+        for user, password in credentials:
+            if any(a.user == user for a in self.accounts):
+                continue
+            account = type(self)(self.base_url, user, password, self.__api_budget)
+            account.executions = self.executions
+            account.start_listeners = self.start_listeners
+            account.listeners = self.listeners
+            self.accounts.append(account)
+
+    def account(self, execution):
+        """ Return the session of the account that started an execution, defaulting to this session. """
+        return next((a for a in self.accounts if a.user == execution.account), self)
+
     def loginFrontend(self):
-        """ Login to the Touchstone website. It requires the environment variables TS_USER and TS_PASS to be set. """
-        self.open("https://touchstone.aegis.net/touchstone/login")
+        """ Login to the Touchstone website. """
+        self.open(f"{self.base_url}/login")
 
         self.select_form('form[id="loginForm"]')
-        self["emailOrLoginID"] = os.environ["TS_USER"]
-        self["password"] = os.environ["TS_PASS"]
+        self["emailOrLoginID"] = self.user
+        self["password"] = self.password
         response = self.submit_selected()
         if "Sign Out" not in response.text:
-            sys.exit("Couldn't login into Touchstone")
+            sys.exit(f"Couldn't login into Touchstone as {self.user}")
 
     def logoutFrontend(self):
-        self.open("https://touchstone.aegis.net/touchstone/logout")
+        self.open(f"{self.base_url}/logout")
 
     def apiKey(self):
         """ Return the API-Key value needed for using the Touchstone API. If this key is not yet known, a new API
@@ -262,91 +817,188 @@ class Touchstone(mechanicalsoup.StatefulBrowser):
 
         if self.__api_key == None:
             body = {
-                "email": os.environ["TS_USER"],
-                "password": os.environ["TS_PASS"]
+                "email": self.user,
+                "password": self.password
             }
-            response = requests.post("https://touchstone.aegis.net/touchstone/api/authenticate", json=body)
+            response = self.session.post(f"{self.base_url}/api/authenticate", json=body)
             if response.status_code != 201 or "API-Key" not in response.json():
-                sys.exit("Couldn't login into the Touchstone API")
+                sys.exit(f"Couldn't login into the Touchstone API as {self.user}")
             self.__api_key = response.json()["API-Key"]
         return self.__api_key
 
-    def executeTargets(self, targets, start_only):
-        """ Execute one the provided list of ExecutionTargets. If start_only is set to True, don't waint for the
-            execution to finish. """
+    def _apiRequest(self, method, path, **kwargs):
+        """ Perform a request on the Touchstone API within the request budget. Return the response and its decoded
+            JSON body (an empty dict if the body isn't JSON). """
+        self.__api_budget.acquire()
+        response = self.session.request(method, f"{self.base_url}/api/{path}", headers = {
+            "API-Key": self.apiKey(),
+            "Accept": "application/json"
+        }, **kwargs)
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        return response, body if isinstance(body, dict) else {}
+
+    def executeTargets(self, targets, start_only, durations = None):
+        """ Execute the provided list of ExecutionTargets. Each target is started as soon as an execution slot is
+            available and the targets it depends on have completed. If start_only is set to True, don't wait for the
+            executions to finish, unless this is needed to start the remaining targets. If durations is provided, it
+            should contain the expected duration per relative path, which is used to start the longest targets first.
+            When multiple accounts are available (see addAccounts()), each target is started on the account that has
+            the fewest running executions. """
         
-        for target in targets:
-            self.executeTarget(target)
-
-            if target.block_until_complete and (start_only == False or targets.index(target) != len(unwrapped) - 1):
-                # We need to wait until completion if this has been defined. This is also true if the --start-only flag
-                # has been set, UNLESS we need to execute more scripts.
-                self.awaitExecutions(Touchstone.AwaitMode.BLOCKING)
+        scheduler = ExecutionScheduler(targets, self.MAX_PARALLEL_EXECUTIONS * len(self.accounts), durations)
+        if durations:
+            print("Starting the targets that took the longest in earlier sessions first, so they may not start in the order in which they were listed")
+        for execution in [e for e in self.executions if e.status in ["Running", ""]]:
+            scheduler.adopt(execution)
+        for account in self.accounts[1:]:
+            account.date_T = self.date_T
+        while scheduler.hasPending():
+            target = scheduler.next()
+            if target is None:
+                self.awaitExecutions(until = scheduler.ready)
+            else:
+                running = [e.account for e in self.executions if e.status in ["Running", ""]]
+                account = min(self.accounts, key = lambda a: running.count(a.user))
+                scheduler.started(target, account.executeTarget(target))
 
         if not start_only:
-            self.awaitExecutions(Touchstone.AwaitMode.ALL)
+            self.awaitExecutions()
 
-    def uploadTarget(self, target: UploadTarget):
-        """ Upload a target to Touchstone. """
+    def uploadTarget(self, target: UploadTarget, manifest: UploadManifest = None):
+        """ Upload a target to Touchstone. If a manifest is provided, the upload is skipped when the target hasn't
+            changed since its last successful upload, and it is updated after a successful upload. Return True if the
+            upload succeeded; an exception is raised if the parent folder doesn't exist on Touchstone. """
+
+        if manifest != None and manifest.isUnchanged(target):
+            print(f"- Skipping {target.rel_path}, nothing changed since the last upload")
+            return True
 
-        print
         print(f"- Uploading {target.rel_path}")
 
         # We're uploading the folder in its parent folder, so let's figure that one out first.
         parts = target.rel_path.split("/")
         parent_folder = "/".join(parts[:-1])
         leaf_folder = parts[-1]
-        parent_group_path = "/FHIRSandbox/Nictiz"
+        parent_group_path = self.GROUP_ROOT
         if parent_folder != "":
             parent_group_path += "/" + parent_folder
         
-        response = self.open(f"https://touchstone.aegis.net/touchstone/testdefinitions?selectedTestGrp={parent_group_path}")
+        response = self.open(f"{self.base_url}/testdefinitions?selectedTestGrp={parent_group_path}")
         if response.status_code != 200 or any(t.text.strip() == "Please select a node under Test Definitions." for t in self.page.find_all("span", class_="alertContent")):
-            print(f"Parent folder '{parent_folder}' for target {target.rel_path} doesn't exist or cannot be accessed, cannot upload")
-            sys.exit(1)
-
-        # Create a zip file to upload
-        tmp_dir = pathlib.Path(tempfile.mkdtemp())
-        if target.kind == "dev": # Filter out groupProps.json on dev uploads.
-            filtered_dir = pathlib.Path(tempfile.mkdtemp()) / leaf_folder
-            shutil.copytree(target.path, filtered_dir, ignore = shutil.ignore_patterns("groupProps.json"))
-            shutil.make_archive(tmp_dir / leaf_folder, "zip", filtered_dir)
-            shutil.rmtree(filtered_dir)
-        else:
-            shutil.make_archive(tmp_dir / leaf_folder, "zip", target.path)
-        
-        # Upload the file
-        self.select_form('form[id="testGroupUploadForm"]')
-        zip_file = open(tmp_dir / f"{leaf_folder}.zip", "rb")
-        self["uploadFile"] = zip_file
-        self["parentGroupPath"] = parent_group_path
-        self["canBeModifiedBy"] = "BY_MY_ORG"
-        self["canBeViewedBy"] = "BY_MY_ORG_GROUP" # Default to this in case the actual access is one or more org groups. It will be overridden in the other situations.
-        for access in target.access:
-            el = self.page.find(lambda tag: tag.name == "label" and tag.text.strip().lower() == access.lower())
-            if el:
-                el = el.find("input")
-                self[el.attrs["name"]] = el.attrs["value"]
-            else:
-                print(f"Access level {access} not found")
-                return False
-        self.form.set_select({"validator": target.validator})
-
-        ok_msg = f"The zip file '{leaf_folder}.zip' containing .* has been uploaded successfully"
-        response = self.submit_selected()
+            raise Exception(f"Parent folder '{parent_folder}' for target {target.rel_path} doesn't exist or cannot be accessed, cannot upload")
+
+        with Touchstone.buildArchive(target, f"{leaf_folder}.zip") as zip_file:
+            # Upload the file
+            self.select_form('form[id="testGroupUploadForm"]')
+            self["uploadFile"] = zip_file
+            self["parentGroupPath"] = parent_group_path
+            self["canBeModifiedBy"] = "BY_MY_ORG"
+            self["canBeViewedBy"] = "BY_MY_ORG_GROUP" # Default to this in case the actual access is one or more org groups. It will be overridden in the other situations.
+            for access in target.access:
+                el = self.page.find(lambda tag: tag.name == "label" and tag.text.strip().lower() == access.lower())
+                if el:
+                    el = el.find("input")
+                    self[el.attrs["name"]] = el.attrs["value"]
+                else:
+                    print(f"  {target.rel_path}: access level {access} not found")
+                    return False
+            self.form.set_select({"validator": target.validator})
 
-        zip_file.close()
-        shutil.rmtree(tmp_dir)
+            ok_msg = f"The zip file '{leaf_folder}.zip' containing .* has been uploaded successfully"
+            response = self.submit_selected()
 
         if response.status_code == 200 and any(re.search(ok_msg, t.text) for t in self.page.find_all("span", class_="alertContent")):
-            print("Success")
+            print(f"  {target.rel_path}: success")
+            if manifest != None:
+                manifest.record(target)
             return True
         else:
-            print("Upload failed")
+            print(f"  {target.rel_path}: upload failed")
             for alert in self.page.find_all("span", class_="alertContent"):
-                print(f"- {alert.text.strip()}")
+                print(f"  - {alert.text.strip()}")
             return False
 
+    @staticmethod
+    def buildArchive(target: UploadTarget, name):
+        """ Zip the folder of an UploadTarget into an ArchiveFile, without making a copy of the folder first. The
+            groupProps.json files are left out on dev uploads. """
+        archive = ArchiveFile(name, Touchstone.ARCHIVE_SPOOL_SIZE)
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED, strict_timestamps = False) as zip:
+            for dir_path, dir_names, file_names in os.walk(target.path):
+                dir_names.sort()
+                rel_dir = pathlib.Path(dir_path).relative_to(target.path)
+                if rel_dir != pathlib.Path("."):
+                    zip.write(dir_path, rel_dir.as_posix())
+                for file_name in sorted(file_names):
+                    if target.kind == "dev" and file_name == "groupProps.json":
+                        continue
+                    zip.write(os.path.join(dir_path, file_name), (rel_dir / file_name).as_posix())
+        archive.seek(0)
+        return archive
+
+    @classmethod
+    def uploadTargets(cls, targets, parallel = None, pool_size = None, manifest: UploadManifest = None):
+        """ Upload a list of UploadTargets, using up to parallel concurrent uploads. Each upload runs in its own
+            Touchstone session with its own login, as the frontend is stateful; the logins are spread over the accounts
+            that are available in the environment (see credentials()). If a manifest is provided, targets that
+            haven't changed since their last upload are skipped, unless a folder above them is uploaded in this run
+            (which replaces them). Return True if all uploads succeeded.
+            Targets are uploaded in the order in which they are provided, except that a target doesn't start before the
+            earlier targets in its parent or child folders are done, as uploading a folder replaces its subfolders. """
+        if manifest != None:
+            changed = [t for t in targets if not manifest.isUnchanged(t)]
+            unchanged = [t for t in targets if t not in changed and
+                         not any(t.rel_path.startswith(c.rel_path + "/") for c in changed)]
+            for target in unchanged:
+                print(f"- Skipping {target.rel_path}, nothing changed since the last upload")
+            targets = [t for t in targets if t not in unchanged]
+        if len(targets) == 0:
+            return True
+
+        parallel = min(parallel or cls.PARALLEL_UPLOADS, len(targets))
+        credentials = cls.credentials() or [(None, None)]
+        touchstones = [cls(None, *credentials[i % len(credentials)]) for i in range(parallel)]
+        available = queue.Queue()
+        futures = {} # Future per target, in submission order
+
+        def related(a, b):
+            return a.rel_path == b.rel_path or a.rel_path.startswith(b.rel_path + "/") or b.rel_path.startswith(a.rel_path + "/")
+
+        def upload(target, waits_for):
+            # The pool runs the uploads in submission order, so the uploads we wait for have already been started.
+            concurrent.futures.wait(waits_for)
+            touchstone = available.get()
+            try:
+                return touchstone.uploadTarget(target, manifest)
+            finally:
+                available.put(touchstone)
+
+        try:
+            for touchstone in touchstones:
+                if pool_size != None:
+                    touchstone.setPoolSize(pool_size)
+                touchstone.loginFrontend()
+                available.put(touchstone)
+            with concurrent.futures.ThreadPoolExecutor(max_workers = max(parallel, 1)) as pool:
+                for target in targets:
+                    waits_for = [f for t, f in futures.items() if related(t, target)]
+                    futures[target] = pool.submit(upload, target, waits_for)
+            success = True
+            for target, future in futures.items():
+                try:
+                    success = future.result() and success
+                except Exception as e:
+                    print(f"  {target.rel_path}: {e}")
+                    success = False
+            return success
+        finally:
+            # Always try to logout, otherwise we'll have too many open sessions.
+            for touchstone in touchstones:
+                touchstone.logoutFrontend()
+
     def _request(self, form, url=None, **kwargs):
         """ Overriden method of mechanicalsoup.Browser to add the content type to zip file uploads.
             MechanicalSoup doesn't pass the content type of file uploads to Requests when making the POST request, but
@@ -363,15 +1015,14 @@ class Touchstone(mechanicalsoup.StatefulBrowser):
         return self.session.request(**request_kwargs)
 
     def executeTarget(self, target: ExecutionTarget):
-        """ Execute one specific target, defined by a ExecutionTarget object """
-        
-        # First, wait until there are execution slots available
-        self.awaitExecutions(Touchstone.AwaitMode.MAX)
+        """ Execute one specific target, defined by a ExecutionTarget object. Return the started Execution, or None if
+            the execution couldn't be started. Note that this doesn't check the number of parallel executions, use
+            executeTargets() for this. """
 
         print(f"- Setting up {target.rel_path}")
 
         # Navigate to the relevant target and select all testscripts that are not loadscripts
-        self.open(f"https://touchstone.aegis.net/touchstone/testdefinitions?selectedTestGrp=/FHIRSandbox/Nictiz/{target.rel_path}&activeOnly=true&contentEntry=TEST_SCRIPTS&ps=200")
+        self.open(f"{self.base_url}/testdefinitions?selectedTestGrp={self.GROUP_ROOT}/{target.rel_path}&activeOnly=true&contentEntry=TEST_SCRIPTS&ps=200")
         select_all = True
         self.select_form('form[id="testDefSearch"]')
         selected_testscripts = []
@@ -385,29 +1036,21 @@ class Touchstone(mechanicalsoup.StatefulBrowser):
 
         # Submit the form
         self.submit_selected()
-        
-        # Select the origin based on its name
-        self._selectOrigDest("origin", target.origins)
-
-        # Select the destination based on its name
-        self._selectOrigDest("dest", target.destinations)
-
-        # Populate all variables
         self.select_form('form[id="testSetupForm"]')
-        if target.params == None:
-            target.params = {"T": self.date_T}
-        elif "T" not in target.params:
-            target.params["T"] = self.date_T
-        for param in target.params:
-            for textarea in self.page.find_all("textarea"): # The name attribute of the targetted textarea is very long and I'm not sure if the beginning is guaranteed to be stable, so we're using a search on all textarea's here and filter out based on the latter part of the name
-                if textarea.attrs["name"].endswith(f"variableSetups.variableSetupMap[{param}]"):
-                    self[textarea.attrs["name"]] = target.params[param].strip()
+        setup_form = SetupForm(self.page)
+        
+        # Select the origin and destination based on their names
+        self._selectOrigDest(setup_form, "origin", target.origins)
+        self._selectOrigDest(setup_form, "dest", target.destinations)
 
         # There's a subtle bug between Touchstone and scripting (happened also with the Twill library) where a newline
         # is added to textareas on load (which is then used repeated back in the default value on a new execution, and
         # a newline is added to it, and so forth). So we need to go over all textareas and strip the whitespace.
-        for textarea in self.page.find_all("textarea"):
-            self[textarea.attrs["name"]] = textarea.text.strip()
+        setup_form.stripTextareas()
+
+        # Populate all variables
+        for param, value in self._variables(target).items():
+            setup_form.setVariable(param, value)
 
         # The submission expects a field called "execute", which is normally sent when clicking the "execute" button.
         # However, for some reason this field is not included when programmatically doing this.
@@ -416,105 +1059,171 @@ class Touchstone(mechanicalsoup.StatefulBrowser):
         # The submission also expects that all hidden fields containing the default values for variables are _not_ sent
         # along. Or rather, if they are present the actual input value is ignored or so it seems. So we have to remove
         # these fields.
-        for input in self.page.find_all("input", class_="ud_defaults"):
-            input.extract()
+        setup_form.removeDefaults()
 
         response = self.submit_selected()
         if response.status_code == 200:
-            print(f"  execution started on {self.url}")
-            execution_id = self.url.replace("https://touchstone.aegis.net/touchstone/execution?exec=", "")
-            self.executions.append(Execution(target, execution_id))
+            return self._started(target, self.url.replace(f"{self.base_url}/execution?exec=", ""))
         else:
             print(f"  couldn't start execution for {target.rel_path}")
+            return None
 
-    def awaitExecutions(self, await_mode):
-        """ Await the started executions by polling the Touchstone API, and report back the results. """
+    def _variables(self, target: ExecutionTarget):
+        """ Return the variables to set on an execution of the target, which always includes T. """
+        if target.params == None:
+            target.params = {"T": self.date_T}
+        elif "T" not in target.params:
+            target.params["T"] = self.date_T
+        return {param: value.strip() for param, value in target.params.items()}
+
+    def _started(self, target: ExecutionTarget, execution_id):
+        """ Register a newly started execution for the target and notify the start listeners. """
+        sequence = len(self.executions) + 1
+        execution = Execution(target, execution_id, url = f"{self.base_url}/execution?exec={execution_id}", account = self.user, sequence = sequence)
+        print(f"  execution #{sequence} started on {execution.url}")
+        self.executions.append(execution)
+        for listener in self.start_listeners:
+            listener(execution)
+        return execution
+
+    def reattach(self, target: ExecutionTarget, execution_id, started_at = None, account = None):
+        """ Add an execution that was started earlier (e.g. in a previous session), so that it will be polled and
+            reported like the executions started in this session. If known, account is the user name of the account that
+            started it. """
+        execution = Execution(target, execution_id, url = f"{self.base_url}/execution?exec={execution_id}", account = account or self.user, sequence = len(self.executions) + 1)
+        if started_at != None:
+            execution.started_at = started_at
+        self.executions.append(execution)
+        return execution
+
+    def awaitExecutions(self, until = None):
+        """ Await the started executions by polling the Touchstone API, and report back the results. If until is
+            provided, it should be a function that returns True as soon as we can stop waiting; otherwise we wait until
+            all executions have finished, after which the results of all executions are printed. While waiting, the
+            progress is shown on a StatusDashboard. """
         
-        if await_mode == Touchstone.AwaitMode.BLOCKING:
-            executions = [e for e in self.executions if e.target.block_until_complete and (e.status == "Running" or e.status == "")]
-        else:
-            executions = self.executions
+        executions = self.executions
+        await_all = until is None
+        if await_all:
+            until = lambda: not any([True for execution in executions if execution.status in ["Running", ""]])
 
         # Figure out if we actually do need to start waiting
-        if await_mode == Touchstone.AwaitMode.MAX:
-            need_to_wait = sum([1 for execution in executions if execution.status in ["Running", ""]]) >= self.MAX_PARALLEL_EXECUTIONS
-        else:
-            need_to_wait = any([True for execution in executions if execution.status in ["Running", ""]])
-        
+        need_to_wait = not until()
         if need_to_wait:
-            if await_mode == Touchstone.AwaitMode.MAX:
-                print("  maximum number of parallel executions started, so we need to wait a bit before we can continue")
-            elif await_mode == Touchstone.AwaitMode.BLOCKING:
-                print("  execution needs to finish before we can continue")
+            if not await_all:
+                print("  waiting for an execution slot or a blocking execution to finish")
             else:
                 print("  waiting for all executions to finish")
-            print("\n### Status ###")
+        dashboard = StatusDashboard(executions, self._statusLine)
 
-        last_polled_at = datetime.datetime(1970, 1, 1)
+        # While a target is waiting to be started, a finished execution shouldn't hold on to its slot for long, so the
+        # executions are polled more often than when we're just waiting for the results.
+        max_interval = self.MAX_POLL_INTERVAL if await_all else min(self.SLOT_POLL_INTERVAL, self.MAX_POLL_INTERVAL)
+        for execution in executions:
+            execution.next_poll_at = min(execution.next_poll_at, time.monotonic() + max_interval)
 
         waiting = need_to_wait
-        while waiting:          
-            for execution in executions:
-                if execution.status == "" or execution.status == "Running":
-                    sleep_time = 4 - (datetime.datetime.now() - last_polled_at).seconds
-                    if sleep_time > 0: time.sleep(sleep_time)
-                    response = requests.get("https://touchstone.aegis.net/touchstone/api/testExecution/" + execution.execution_id, headers = {
-                        "API-Key": self.apiKey(),
-                        "Accept": "application/json"
-                    })
-                    last_polled_at = datetime.datetime.now()
-
-                    if response.status_code != 200 or "status" not in response.json():
-                        execution.status = "Unknown"
-                        print(response)
-                    else:
-                        execution.status = response.json()["status"]
-                        execution.duration = response.json()["duration"]
-
-                        stats = response.json()["statusCounts"]
-                        execution.total = stats["numberOfTests"]
-                        execution.passes = 0 if "numberOfTestPasses" not in stats else stats["numberOfTestPasses"]
-                        execution.warns =  0 if "numberOfTestPassesWarn" not in stats else stats["numberOfTestPassesWarn"]
-                        execution.fails =  0 if "numberOfTestFailures" not in stats else stats["numberOfTestFailures"]
-                
-                total_completed = execution.passes + execution.warns + execution.fails
-                if execution.status == "Unknown":
-                    line = "  Status couldn't be retrieved"
-                elif execution.status == "Running":
-                    line = f"  {total_completed}/{execution.total} tests completed with {execution.passes} passes, {execution.warns} warnings and {execution.fails} failures (running for {execution.duration})"
-                else:
-                    line = "  "
-                    line += "✅" if execution.status == "Passed" else "❌"
-                    line += f" {execution.passes} passed, {execution.warns} passed with warnings, {execution.fails} failed"
-                    if execution.total > (total_completed):
-                        line += f" ({execution.total - total_completed} never started)"
-                
-                print("\033[2K- " + execution.target.rel_path)
-                print("\033[2K" + line)
-            
-            if await_mode == Touchstone.AwaitMode.MAX:
-                waiting = sum([1 for execution in executions if execution.status == "Running"]) >= self.MAX_PARALLEL_EXECUTIONS
-            else:
-                waiting = any([True for execution in executions if execution.status == "Running"])
-
+        while waiting:
+            # Each execution has its own poll schedule, so only refresh the ones that are due
+            running = [e for e in executions if e.status in ["Running", ""]]
+            if len(running) > 0:
+                sleep_time = min(e.next_poll_at for e in running) - time.monotonic()
+                if sleep_time > 0: time.sleep(sleep_time)
+                self._pollExecutions([e for e in running if e.next_poll_at <= time.monotonic()], max_interval)
+
+            waiting = not until()
             if waiting:
-                # Move the cursor to the beginning of the status report block
-                print(f"\033[{len(executions) * 2 + 1}A")
+                dashboard.render()
         
         if need_to_wait:
-            if await_mode == Touchstone.AwaitMode.ALL:
+            # The process flow continues, so we need to erase the dashboard
+            dashboard.clear()
+            if await_all:
+                print("### Status ###")
+                for execution in executions:
+                    print("- " + execution.target.rel_path)
+                    print(self._statusLine(execution))
+                print(dashboard.summary())
                 print("### End status ###\n")
-            else:
-                # If we were awaiting MAX or BLOCKING, the process flow continues so we need to erase everything
-                print(f"\033[{len(executions) * 2 + 2}A\033[J\033[A")
 
-    def _selectOrigDest(self, type, values):
+    def _pollExecutions(self, executions, max_interval = None):
+        """ Refresh the status of all provided executions concurrently. The number of requests is limited by the
+            request budget, so a refresh takes about one round-trip as long as the budget allows it. """
+        for account in set(self.account(e) for e in executions):
+            account.apiKey() # Make sure the API keys are known before the threads need them
+        for future in [self.__poll_pool.submit(self._pollExecution, execution, max_interval) for execution in executions]:
+            future.result()
+
+    def _pollExecution(self, execution, max_interval = None):
+        """ Refresh the status of a single execution using the Touchstone API. The listeners are notified when the
+            execution has finished. The status is requested by the account that started the execution. If the status
+            can't be retrieved, the execution is marked as "Unknown". """
+        try:
+            response, body = self.account(execution)._apiRequest("GET", f"testExecution/{execution.execution_id}")
+        except requests.RequestException as e:
+            response, body = e, None
+
+        if body == None or response.status_code != 200 or "status" not in body:
+            execution.status = "Unknown"
+            print(response)
+        else:
+            execution.status = body["status"]
+            execution.duration = body["duration"]
+
+            stats = body["statusCounts"]
+            execution.total = stats["numberOfTests"]
+            execution.passes = 0 if "numberOfTestPasses" not in stats else stats["numberOfTestPasses"]
+            execution.warns =  0 if "numberOfTestPassesWarn" not in stats else stats["numberOfTestPassesWarn"]
+            execution.fails =  0 if "numberOfTestFailures" not in stats else stats["numberOfTestFailures"]
+
+        if execution.status in ["Running", ""]:
+            self._schedulePoll(execution, max_interval)
+        else:
+            execution.finished_at = time.time()
+            for listener in self.listeners:
+                listener(execution)
+
+    def _schedulePoll(self, execution, max_interval = None):
+        """ Determine when the status of a running execution should be refreshed again. The time to completion is
+            estimated from the rate at which tests have completed since the execution was first seen. The next poll is
+            done halfway this estimate, so polling becomes more frequent near completion. If no progress has been seen,
+            the interval is increased step by step, up to max_interval (MAX_POLL_INTERVAL by default). """
+        now = time.monotonic()
+        completed = execution.passes + execution.warns + execution.fails
+        if execution.first_seen == None:
+            execution.first_seen = (now, completed)
+            interval = self.MIN_POLL_INTERVAL
+        else:
+            first_time, first_completed = execution.first_seen
+            rate = (completed - first_completed) / max(now - first_time, 1)
+            if rate > 0:
+                interval = (execution.total - completed) / rate / 2
+            else:
+                interval = execution.poll_interval * self.POLL_BACKOFF
+        execution.poll_interval = min(max(interval, self.MIN_POLL_INTERVAL), max_interval or self.MAX_POLL_INTERVAL)
+        execution.next_poll_at = now + execution.poll_interval
+
+    def _statusLine(self, execution):
+        """ Return a single line describing the status of an execution. """
+        total_completed = execution.passes + execution.warns + execution.fails
+        if execution.status == "Unknown":
+            line = "  Status couldn't be retrieved"
+        elif execution.status == "Running":
+            line = f"  {total_completed}/{execution.total} tests completed with {execution.passes} passes, {execution.warns} warnings and {execution.fails} failures (running for {execution.duration})"
+        else:
+            line = "  "
+            line += "✅" if execution.status == "Passed" else "❌"
+            line += f" {execution.passes} passed, {execution.warns} passed with warnings, {execution.fails} failed"
+            if execution.total > (total_completed):
+                line += f" ({execution.total - total_completed} never started)"
+        return line
+
+    def _selectOrigDest(self, setup_form, type, values):
         """ Select origin or destination dropdowns on the Touchstone UI during execution setup.
+            * setup_form: the SetupForm for the currently selected testSetupForm
             * type: "origin" or "dest"
             * values: A list of origins or destinations to select.
         """
-        self.select_form('form[id="testSetupForm"]')
-
         for i in range(len(values)):
             if i == 0:
                 dropdown_ids = [f"main{type.lower()}1TsSelect", f"single{type.capitalize()}TsSelect"] # If a origin/destination is explicitly defined in the TestScript, the select box has a different id then when it is absent
@@ -522,7 +1231,6 @@ class Touchstone(mechanicalsoup.StatefulBrowser):
                 dropdown_ids = [f"main{type.lower()}{i + 1}TsSelect"]
 
             for id in dropdown_ids:
-                dropdowns = self.page.find_all("select", id=id)
-                if len(dropdowns) > 0:
-                    self[dropdowns[0].attrs["name"]] = values[i]
+                if id in setup_form.selects:
+                    self.form.set_select({setup_form.selects[id].attrs["name"]: values[i]})
 
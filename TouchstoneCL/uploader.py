@@ -1,13 +1,15 @@
 from ts import *
 
 if __name__ == "__main__":
-    touchstone = Touchstone()
-
     parser = argparse.ArgumentParser()
     parser.add_argument("-r", "--repo-root", default = pathlib.Path(".") / "../../Nictiz-testscripts")
     parser.add_argument("-f", "--properties-file", default = "properties.yml")
     parser.add_argument("--production", action = "store_true")
-    parser.add_argument("target", nargs = "*", help = "The targets to execute (both numbers and mnemonics are supported)")
+    parser.add_argument("--pool-size", type = int, help = f"Number of keep-alive connections to Touchstone (default is {Touchstone.POOL_SIZE})")
+    parser.add_argument("-j", "--parallel", type = int, default = Touchstone.PARALLEL_UPLOADS, help = f"Number of folders to upload at the same time, each using a separate login (default is {Touchstone.PARALLEL_UPLOADS})")
+    parser.add_argument("-m", "--manifest", default = ".upload-manifest.json", help = "File to keep track of what has been uploaded, to skip folders that didn't change (default is '.upload-manifest.json')")
+    parser.add_argument("--force", action = "store_true", help = "Upload all targets, even if they didn't change since the last upload")
+    parser.add_argument("target", nargs = "*", help = "The targets to upload (numbers, relative paths, glob patterns and mnemonics are supported)")
     args = parser.parse_args()
 
     known_targets = KnownTargets(args.repo_root, args.properties_file)
@@ -20,13 +22,7 @@ if __name__ == "__main__":
     else:
         folders = args.target
 
-    try:
-        touchstone.loginFrontend()
-
-        for folder_num in folders:
-            target = known_targets.getUploadTarget(folder_num, "production" if args.production else "dev")
-            touchstone.uploadTarget(target)
-
-    finally:
-        # Always try to logout, otherwise we'll have too many open sessions.
-        touchstone.logoutFrontend()
+    targets = known_targets.getUploadTargets(folders, "production" if args.production else "dev")
+    manifest = UploadManifest(args.manifest, args.force)
+    if len(targets) > 0 and not Touchstone.uploadTargets(targets, args.parallel, args.pool_size, manifest):
+        sys.exit(1)
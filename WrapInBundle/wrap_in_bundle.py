@@ -15,38 +15,101 @@ Behavior:
 - Always uses `request.method`: POST
 - Always strips `id` fields
 - Uses `request.url`: `<resourceType>`
-- Adds `fullUrl`: `urn:uuid:<uuid4>`
+- Adds `fullUrl`: `urn:uuid:<uuid5>`, derived from the resource type and id (or, for a resource without
+  id, from the path of the file within the input directory and the position of the resource in it), so
+  the same input always gives the same Bundle. The fullUrls can be kept in, and taken from, a persistent
+  ID map (`--id-map`)
 - Automatically rewrites internal references (`ResourceType/id`) to the matching `fullUrl`
 - Warns when a reference cannot be resolved to any resource in the input
+- With FHIR StructureDefinitions (`--structure-definitions`), only the elements where references can
+  occur are visited to rewrite them in JSON resources, instead of every element of every resource
+- The Bundle is streamed to the output one entry at a time, so memory use doesn't grow with the
+  number of resources; XML inputs are parsed incrementally, so even for huge input Bundles memory
+  use is bounded by the largest resource (uses `orjson` for JSON when it is installed)
+- Input files can be read in parallel processes (`--jobs`); the output doesn't depend on the number
+  of processes
+- Optionally splits the output over multiple Bundles with a maximum number of entries (`--max-entries`)
+  and/or size (`--max-bytes`). Resources that are connected through references always end up in the
+  same Bundle, so the Bundles can be loaded independently of each other
+- Optionally keeps a build cache (`--cache`) with the results for each input file, so that a rebuild
+  only reads the input files that have changed since the previous build
+- Optionally POSTs the Bundle(s) to a FHIR server (`--post-to`), several at a time over a pool of
+  connections, retrying only when the server certainly didn't process a Bundle, and reports the
+  latency and throughput per Bundle
 
 Examples:
   python bundle_transaction.py ./json-resources -o bundle.json
   python bundle_transaction.py ./xml-resources -o bundle.xml
   python bundle_transaction.py patients.json observations.xml -o bundle.any
+  python bundle_transaction.py ./json-resources -o bundle.json --max-entries 1000  # bundle-0001.json, ...
+  python bundle_transaction.py ./json-resources --max-entries 1000 --post-to http://localhost:8080/fhir
 """
 from __future__ import annotations
 
 import argparse
-import copy
+import collections
+import concurrent.futures
+import functools
+import hashlib
 import json
+import os
+import sqlite3
 import sys
+import tempfile
+import time
 import uuid
 import xml.etree.ElementTree as ET
 import re
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, TextIO, Tuple
+
+try:
+    import orjson
+except ImportError:  # optional, only used to speed up JSON parsing and serialization
+    orjson = None
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+except ImportError:  # optional, only needed for --post-to
+    requests = None
 
 FHIR_JSON_EXTS = {".json"}
 FHIR_XML_EXTS = {".xml"}
 
 _REF_KEY_RE = re.compile(r"^[A-Za-z][A-Za-z0-9]{0,63}/[A-Za-z0-9\-.]{1,64}$")
 
+# A run of digits that may be a number beyond the 64 bit range of orjson, see _load_json(). The input is
+# translated with _DIGIT_TABLE first (digits to "0", anything else to a space), which is a lot faster than a regex.
+_LONG_NUMBER = b"0" * 19
+_DIGIT_TABLE = bytes(0x30 if 0x30 <= b <= 0x39 else 0x20 for b in range(256))
+
+# Namespace for the uuid5 fullUrls, see _fullurl_key()
+FULLURL_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "https://nictiz.nl/snippets/WrapInBundle")
+
+# Stands in for a fullUrl when estimating the size of an entry before the fullUrls are assigned
+_FULLURL_PLACEHOLDER = f"urn:uuid:{uuid.UUID(int=0)}"
+
 ET.register_namespace("", "http://hl7.org/fhir")
 
 @dataclass
 class Options:
     output: Optional[Path]
+    jobs: int = 1
+    max_entries: Optional[int] = None
+    max_bytes: Optional[int] = None
+    structure_definitions: Sequence[Path] = ()
+    post_to: Optional[str] = None
+    post_jobs: int = 4
+    post_retries: int = 3
+    id_map: Optional[Path] = None
+    cache: Optional[Path] = None
+
+    @property
+    def split(self) -> bool:
+        return self.max_entries is not None or self.max_bytes is not None
 
 @dataclass
 class ResourceItem:
@@ -55,6 +118,15 @@ class ResourceItem:
     id: Optional[str]
     payload: Any  # dict for JSON, ET.Element for XML
 
+@dataclass
+class ScannedResource:
+    """What the first pass over the input files needs to know about a resource."""
+    resourceType: str
+    id: Optional[str]
+    ns: Optional[str] = None  # XML only
+    references: Tuple[str, ...] = ()  # only collected when splitting
+    size: int = 0  # approximate size of the entry in the output, only computed for --max-bytes
+
 # ------------------------- Loaders -------------------------
 
 def _validate_resource_dict(res: Dict[str, Any], source: str) -> None:
@@ -62,9 +134,24 @@ def _validate_resource_dict(res: Dict[str, Any], source: str) -> None:
         raise ValueError(f"Not a FHIR resource in {source}: missing resourceType")
 
 
-def load_json_items(path: Path) -> Iterable[ResourceItem]:
+def _load_json(path: Path) -> Any:
+    """orjson turns integers beyond 64 bits into floats, and rejects numbers beyond the float range. The json
+    module is used instead for files that contain such long numbers, so the output doesn't depend on whether
+    orjson is installed."""
+    if orjson is not None:
+        data = path.read_bytes()
+        if _LONG_NUMBER not in data.translate(_DIGIT_TABLE):
+            try:
+                return orjson.loads(data)
+            except orjson.JSONDecodeError:
+                pass  # let the json module report the error
+        return json.loads(data.decode("utf-8"))
     with path.open("r", encoding="utf-8") as f:
-        obj = json.load(f)
+        return json.load(f)
+
+
+def load_json_items(path: Path) -> Iterable[ResourceItem]:
+    obj = _load_json(path)
     if isinstance(obj, dict) and obj.get("resourceType") == "Bundle":
         for j, e in enumerate(obj.get("entry") or [], start=1):
             r = e.get("resource")
@@ -97,88 +184,312 @@ def _read_id_from_xml(root: ET.Element) -> Optional[str]:
     return id_el.attrib.get("value")
 
 
-def _iter_bundle_resources_from_xml(bundle_root: ET.Element) -> Iterable[ET.Element]:
-    for entry in bundle_root.findall(".//{*}entry"):
-        res_container = entry.find("{*}resource")
-        if res_container is None:
+def iter_xml_resources(path: Path) -> Iterable[ET.Element]:
+    """Yield the resources in an XML file while it is being parsed: the root element, or for a Bundle the
+    resources in its entries (Bundle/entry/resource/*). Processed entries are detached from the Bundle, so
+    only the resource that is being yielded is kept in memory."""
+    stack: List[str] = []
+    bundle: Optional[ET.Element] = None
+    for event, elem in ET.iterparse(str(path), events=("start", "end")):
+        if event == "start":
+            stack.append(_local(elem.tag))
+            if len(stack) == 1 and stack[0] == "Bundle":
+                bundle = elem
             continue
-        for child in list(res_container):
-            yield child
+        if len(stack) == 1 and bundle is None:
+            yield elem
+        elif bundle is not None and len(stack) == 4 and stack[1] == "entry" and stack[2] == "resource":
+            yield elem
+        elif bundle is not None and len(stack) == 2:
+            bundle.remove(elem)
+        stack.pop()
 
 
-def load_xml_items(path: Path) -> Iterable[ResourceItem]:
-    tree = ET.parse(path)
-    root = tree.getroot()
-    rtype = _local(root.tag)
-    if rtype == "Bundle":
-        for res_el in _iter_bundle_resources_from_xml(root):
-            yield ResourceItem("xml", _local(res_el.tag), _read_id_from_xml(res_el), res_el)
-    else:
-        yield ResourceItem("xml", rtype, _read_id_from_xml(root), root)
+def _path_sort_key(path: Path) -> Tuple[str, ...]:
+    """Sorts paths in the same order as comparing the Path objects themselves (case-insensitive on Windows),
+    which is slow for large numbers of paths."""
+    return tuple(part.lower() for part in path.parts) if os.name == "nt" else path.parts
 
 
-def iter_input_paths(inputs: Sequence[Path]) -> Iterable[Path]:
+def iter_input_sources(inputs: Sequence[Path]) -> Iterable[Tuple[Path, str]]:
+    """Yield the input files, each with its path relative to the input directory it was found in (or just
+    its name if it was given as a file), which doesn't depend on the working directory."""
     for p in inputs:
         if p.is_dir():
-            for child in sorted(p.rglob("*")):
+            for child in sorted(p.rglob("*"), key=_path_sort_key):
                 if child.is_file() and child.suffix.lower() in (FHIR_JSON_EXTS | FHIR_XML_EXTS):
-                    yield child
+                    yield child, child.relative_to(p).as_posix()
         elif p.is_file() and p.suffix.lower() in (FHIR_JSON_EXTS | FHIR_XML_EXTS):
-            yield p
+            yield p, p.name
+
+
+def iter_input_paths(inputs: Sequence[Path]) -> Iterable[Path]:
+    for path, _ in iter_input_sources(inputs):
+        yield path
+
+# ------------------------- Reference index -------------------------
+
+class ReferenceIndex:
+    """For each resource and data type, the JSON keys that can contain a Reference, directly or somewhere
+    below them (e.g. Identifier.assigner, or the extensions that nearly every element can have). Compiled
+    from the FHIR StructureDefinitions, so that rewriting references only needs to visit these elements.
+
+    Types are named by their type code, and inline (backbone) elements by their path, like "Patient.contact".
+    Resources and types that aren't in the definitions are searched completely, and so are elements that aren't
+    in the definitions of their type (e.g. when the definitions are of another FHIR version). This is used for
+    JSON only, as for XML the search of ElementTree itself is faster than a walk in Python."""
+
+    def __init__(self, keys: Dict[str, Dict[str, Optional[str]]]):
+        self.keys = keys  # type -> JSON key -> type of the value, or None if it can't contain a Reference
+
+    @classmethod
+    def from_structure_definitions(cls, definitions: Iterable[Dict[str, Any]]) -> "ReferenceIndex":
+        elements: Dict[str, Dict[str, Optional[str]]] = {}
+        for sd in definitions:
+            if sd.get("derivation") == "constraint":
+                continue  # profiles don't add any elements
+            for el in (sd.get("snapshot") or {}).get("element", []):
+                path = el.get("path", "")
+                if "." not in path:
+                    if sd.get("kind") == "resource":
+                        elements.setdefault(path, {})["resourceType"] = None
+                    continue
+                parent, name = path.rsplit(".", 1)
+                found = elements.setdefault(parent, {})
+                if "contentReference" in el:
+                    found[name] = el["contentReference"].split("#", 1)[-1]
+                for t in el.get("type", []):
+                    code = t.get("code", "")
+                    if code.startswith("http://hl7.org/fhirpath/"):
+                        found.setdefault(name, None)  # the primitive values themselves, and id and url
+                        continue
+                    if code in ("Element", "BackboneElement"):
+                        child = path
+                    else:
+                        child = code
+                    key = name[:-3] + code[:1].upper() + code[1:] if name.endswith("[x]") else name
+                    if code[:1].islower():
+                        found.setdefault(key, None)  # the primitive value itself
+                        key = "_" + key  # extensions of primitives are in a separate key
+                    found[key] = child
+
+        # Only descend into the elements whose type can (eventually) contain a Reference. Types without a
+        # definition might, so these are searched completely.
+        reaching = {"Reference", "Resource"}
+        reaching.update(child for found in elements.values() for child in found.values() if child is not None and child not in elements)
+        changed = True
+        while changed:
+            changed = False
+            for t, found in elements.items():
+                if t not in reaching and any(child in reaching for child in found.values()):
+                    reaching.add(t)
+                    changed = True
+        return cls({
+            t: {key: child if child in reaching else None for key, child in found.items()}
+            for t, found in elements.items()
+        })
+
+    def rewrite_json(self, node: Dict[str, Any], type_name: str, refmap: Dict[str, str], unresolved: List[str]) -> None:
+        """Like _rewrite_references_json(), for a node of the given type."""
+        if type_name == "Resource":  # e.g. contained resources
+            type_name = node.get("resourceType", "")
+        keys = self.keys.get(type_name)
+        if keys is None:
+            _rewrite_references_json(node, refmap, unresolved)
+            return
+        if type_name == "Reference":
+            value = node.get("reference")
+            if isinstance(value, str) and _REF_KEY_RE.match(value):
+                if value in refmap:
+                    node["reference"] = refmap[value]
+                else:
+                    unresolved.append(value)
+        for key, value in node.items():
+            child = keys.get(key, "")
+            if child is None:
+                continue
+            if not child:  # not in the definitions, so anything could be in there
+                _rewrite_references_json(value, refmap, unresolved)
+                continue
+            for item in value if isinstance(value, list) else [value]:
+                if isinstance(item, dict):
+                    self.rewrite_json(item, child, refmap, unresolved)
+
+
+def load_reference_index(paths: Sequence[Path]) -> Optional[ReferenceIndex]:
+    """Compile a ReferenceIndex from the StructureDefinitions in the given JSON files or directories (as single
+    resources or in Bundles, like profiles-resources.json and profiles-types.json from the FHIR specification).
+    Returns None if no StructureDefinitions are found."""
+    definitions = []
+    for path in iter_input_paths(paths):
+        if path.suffix.lower() not in FHIR_JSON_EXTS:
+            continue
+        obj = _load_json(path)
+        if isinstance(obj, dict) and obj.get("resourceType") == "Bundle":
+            resources = [e.get("resource") or {} for e in obj.get("entry") or []]
+        else:
+            resources = [obj]
+        definitions += [r for r in resources if isinstance(r, dict) and r.get("resourceType") == "StructureDefinition"]
+    if not definitions:
+        return None
+    return ReferenceIndex.from_structure_definitions(definitions)
 
 # ------------------------- Bundle builders -------------------------
 
-def _assign_fullurls(items: Iterable[ResourceItem]) -> Tuple[List[ResourceItem], Dict[str, str], Dict[int, str]]:
+def _fullurl_key(source: str, resource_type: str, resource_id: Optional[str], position: int) -> str:
+    """Identify a resource by its type and id, or if it has no id by its source file (see
+    iter_input_sources()) and its position in that file."""
+    return f"{resource_type}/{resource_id}" if resource_id else f"{source}#{position}"
+
+
+def _assign_fullurls(items: Iterable[ResourceItem], sources: Optional[Iterable[str]] = None, id_map: Optional[Dict[str, str]] = None) -> Tuple[List[ResourceItem], Dict[str, str], Dict[int, str]]:
+    """Assign a fullUrl to each item: a uuid5 of its _fullurl_key() in FULLURL_NAMESPACE, using the
+    source file name of each item from sources. If id_map is given, the fullUrls in it are used for the keys that
+    are in it, and the new keys are added to it. Returns the items, a map from "Type/id" references to
+    fullUrls and a map from item index to fullUrl."""
     items_list: List[ResourceItem] = list(items)
+    sources = list(sources) if sources is not None else [""] * len(items_list)
     refmap: Dict[str, str] = {}
     index_to_fullurl: Dict[int, str] = {}
-    for i, it in enumerate(items_list):
-        fu = f"urn:uuid:{uuid.uuid4()}"
+    positions: Dict[str, int] = {}
+    occurrences: Dict[str, int] = {}
+    for i, (it, source) in enumerate(zip(items_list, sources)):
+        position = positions.get(source, 0)
+        positions[source] = position + 1
+        key = _fullurl_key(source, it.resourceType, it.id, position)
+        n = occurrences.get(key, 0) + 1
+        occurrences[key] = n
+        if n > 1:  # the same resource might occur more than once
+            key = f"{key}#{n}"
+        fu = id_map.get(key) if id_map is not None else None
+        if fu is None:
+            fu = f"urn:uuid:{uuid.uuid5(FULLURL_NAMESPACE, key)}"
+        if id_map is not None:
+            id_map[key] = fu
         index_to_fullurl[i] = fu
         if it.id:
             refmap[f"{it.resourceType}/{it.id}"] = fu
     return items_list, refmap, index_to_fullurl
 
 
+def load_id_map(path: Path) -> Dict[str, str]:
+    """Read an ID map (a JSON object with the fullUrl per _fullurl_key()), or return an empty one if the
+    file doesn't exist yet."""
+    if not path.exists():
+        return {}
+    with path.open("r", encoding="utf-8") as f:
+        id_map = json.load(f)
+    if not isinstance(id_map, dict) or not all(isinstance(v, str) for v in id_map.values()):
+        raise ValueError("expected a JSON object with fullUrls")
+    return id_map
+
+
+def save_id_map(path: Path, id_map: Dict[str, str]) -> None:
+    """Write the ID map, sorted by key so it can be diffed. The file is replaced in one go, so it isn't left
+    half written if something goes wrong."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("w", encoding="utf-8", newline="") as f:
+        json.dump(id_map, f, indent=2, sort_keys=True, ensure_ascii=False)
+        f.write("\n")
+    os.replace(tmp, path)
+
+
 def _rewrite_references_json(node: Any, refmap: Dict[str, str], unresolved: List[str]) -> Any:
+    """Rewrite the references in a JSON resource in place; returns the same node."""
     if isinstance(node, dict):
-        out = {}
         for k, v in node.items():
             if k == "reference" and isinstance(v, str) and _REF_KEY_RE.match(v):
                 if v in refmap:
-                    out[k] = refmap[v]
+                    node[k] = refmap[v]
                 else:
                     unresolved.append(v)
-                    out[k] = v
-            else:
-                out[k] = _rewrite_references_json(v, refmap, unresolved)
-        return out
-    if isinstance(node, list):
-        return [_rewrite_references_json(x, refmap, unresolved) for x in node]
+            elif isinstance(v, (dict, list)):
+                _rewrite_references_json(v, refmap, unresolved)
+    elif isinstance(node, list):
+        for x in node:
+            if isinstance(x, (dict, list)):
+                _rewrite_references_json(x, refmap, unresolved)
     return node
 
 
-def build_json_bundle(items: Iterable[ResourceItem]) -> Dict[str, Any]:
-    items_list, refmap, index_to_fullurl = _assign_fullurls(items)
-    entries = []
-    unresolved: List[str] = []
-    for i, it in enumerate(items_list):
-        res = copy.deepcopy(it.payload)
-        res.pop("id", None)
-        res = _rewrite_references_json(res, refmap, unresolved)
-        entry = {
-            "fullUrl": index_to_fullurl[i],
-            "resource": res,
-            "request": {"method": "POST", "url": it.resourceType},
-        }
-        entries.append(entry)
-
+def _warn_unresolved(unresolved: Iterable[str]) -> None:
+    unresolved = set(unresolved)
     if unresolved:
         print("Warning: unresolved references detected:", file=sys.stderr)
-        for r in sorted(set(unresolved)):
+        for r in sorted(unresolved):
             print(f"  - {r}", file=sys.stderr)
 
-    return {"resourceType": "Bundle", "type": "transaction", "entry": entries}
+
+def _json_entry(res: Dict[str, Any], resource_type: str, fullurl: str, refmap: Dict[str, str], unresolved: List[str], index: Optional[ReferenceIndex] = None) -> Dict[str, Any]:
+    """Turn a resource into a transaction entry. The resource is modified in place."""
+    res.pop("id", None)
+    if index is not None:
+        index.rewrite_json(res, resource_type, refmap, unresolved)
+    else:
+        _rewrite_references_json(res, refmap, unresolved)
+    return {
+        "fullUrl": fullurl,
+        "resource": res,
+        "request": {"method": "POST", "url": resource_type},
+    }
+
+
+def iter_json_entries(files: Sequence[Path], index_to_fullurl: Dict[int, str], refmap: Dict[str, str], unresolved: List[str], start: int = 0, index: Optional[ReferenceIndex] = None) -> Iterable[Dict[str, Any]]:
+    """Read the files again and yield their transaction entries one by one, using the fullUrls assigned
+    by _assign_fullurls() on a previous pass over the same files. start is the index of the first
+    resource in files."""
+    i = start
+    for f in files:
+        for it in load_json_items(f):
+            yield _json_entry(it.payload, it.resourceType, index_to_fullurl[i], refmap, unresolved, index)
+            i += 1
+
+
+def _orjson_compatible(node: Any) -> bool:
+    """orjson formats floats in exponent notation (and non-finite floats) differently from the json module.
+    Return False if any of these occur, so the output doesn't depend on whether orjson is installed."""
+    if isinstance(node, float):
+        return node == 0 or 1e-4 <= abs(node) < 1e16
+    if isinstance(node, dict):
+        return all(_orjson_compatible(v) for v in node.values())
+    if isinstance(node, list):
+        return all(_orjson_compatible(v) for v in node)
+    return True
+
+
+def _dumps_json(obj: Any) -> str:
+    if orjson is not None and _orjson_compatible(obj):
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode("utf-8")
+        except orjson.JSONEncodeError:
+            pass  # e.g. integers beyond 64 bits
+    return json.dumps(obj, indent=2, ensure_ascii=False)
+
+
+class JsonBundleSink:
+    """Writes a transaction Bundle to out, one entry (serialized by _dumps_json()) at a time. The result is the
+    same as json.dumps(bundle, indent=2, ensure_ascii=False) followed by a newline."""
+
+    def __init__(self, out: TextIO):
+        self.out = out
+        self.count = 0
+        out.write('{\n  "resourceType": "Bundle",\n  "type": "transaction",\n  "entry": [')
+
+    def add(self, entry: str) -> None:
+        self.out.write("\n    " if self.count == 0 else ",\n    ")
+        self.out.write(entry.replace("\n", "\n    "))
+        self.count += 1
+
+    def close(self) -> None:
+        self.out.write("]\n}\n" if self.count == 0 else "\n  ]\n}\n")
+
+
+def _json_entry_size(res: Dict[str, Any], resource_type: str, references: List[str], index: Optional[ReferenceIndex] = None) -> int:
+    """Return the size in bytes the resource takes up as an entry in a JSON Bundle, with the references
+    not yet rewritten. The references are added to the given list. The resource is modified in place."""
+    entry = _json_entry(res, resource_type, _FULLURL_PLACEHOLDER, {}, references, index)
+    return len(_dumps_json(entry).replace("\n", "\n    ").encode("utf-8")) + len(",\n    ")
 
 
 def _rewrite_references_xml(elem: ET.Element, refmap: Dict[str, str], unresolved: List[str]) -> None:
@@ -193,44 +504,487 @@ def _rewrite_references_xml(elem: ET.Element, refmap: Dict[str, str], unresolved
                 unresolved.append(val)
 
 
-def build_xml_bundle(items: Iterable[ResourceItem], namespace: Optional[str]) -> ET.ElementTree:
-    items_list, refmap, index_to_fullurl = _assign_fullurls(items)
-    ns = namespace or "http://hl7.org/fhir"
+def _xml_entry(res_el: ET.Element, resource_type: str, fullurl: str, refmap: Dict[str, str], unresolved: List[str], ns: str) -> ET.Element:
+    """Turn a resource into a transaction entry. The resource is modified in place."""
     def T(local: str) -> str:
         return f"{{{ns}}}{local}"
 
-    bundle = ET.Element(T("Bundle"))
-    type_el = ET.SubElement(bundle, T("type"))
-    type_el.set("value", "transaction")
+    entry = ET.Element(T("entry"))
+    full = ET.SubElement(entry, T("fullUrl"))
+    full.set("value", fullurl)
+
+    res_container = ET.SubElement(entry, T("resource"))
+    for child in list(res_el):
+        if _local(child.tag) == "id":
+            res_el.remove(child)
+            break
+    _rewrite_references_xml(res_el, refmap, unresolved)
+    res_container.append(res_el)
+
+    req = ET.SubElement(entry, T("request"))
+    m_el = ET.SubElement(req, T("method"))
+    m_el.set("value", "POST")
+    u_el = ET.SubElement(req, T("url"))
+    u_el.set("value", resource_type)
+    return entry
+
+
+class XmlBundleWriter:
+    """Serializes a transaction Bundle one element at a time, with the same result as serializing the whole
+    Bundle tree with ElementTree. ElementTree declares all namespaces that are used on the root element, so
+    each element is serialized within a Bundle element that uses all namespaces of the output (given in
+    order of first appearance), and then cut out."""
+
+    def __init__(self, ns: str, uris: Sequence[str]):
+        self.ns = ns
+        self._wrapper = ET.Element(f"{{{ns}}}Bundle")
+        for uri in [ns, *uris]:
+            ET.SubElement(self._wrapper, f"{{{uri}}}x")
+        skeleton = ET.tostring(self._wrapper, encoding="unicode")
+        self.start_tag = skeleton[: skeleton.index(">") + 1]
+        self.end_tag = skeleton[skeleton.rindex("</"):]
+        self._prefix_len = len(skeleton) - len(self.end_tag)
+
+    def serialize(self, elem: ET.Element) -> str:
+        self._wrapper.append(elem)
+        try:
+            text = ET.tostring(self._wrapper, encoding="unicode")
+        finally:
+            self._wrapper.remove(elem)
+        return text[self._prefix_len : -len(self.end_tag)]
+
+    def type_element(self) -> str:
+        type_el = ET.Element(f"{{{self.ns}}}type")
+        type_el.set("value", "transaction")
+        return self.serialize(type_el)
+
+
+class XmlBundleSink:
+    """Writes a transaction Bundle to out, one entry (serialized by an XmlBundleWriter) at a time. The XML
+    declaration matches that of ElementTree.write() for files, and ET.tostring() for stdout."""
+
+    def __init__(self, writer: XmlBundleWriter, out: TextIO, stdout: bool = False):
+        self.out = out
+        self.count = 0
+        self._end = writer.end_tag + ("\n" if stdout else "")
+        if stdout:
+            out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        else:
+            out.write("<?xml version='1.0' encoding='utf-8'?>\n")
+        out.write(writer.start_tag)
+        out.write(writer.type_element())
+
+    def add(self, entry: str) -> None:
+        self.out.write(entry)
+        self.count += 1
+
+    def close(self) -> None:
+        self.out.write(self._end)
+
+
+def _xml_entry_size(res_el: ET.Element, resource_type: str, references: List[str]) -> int:
+    """Like _json_entry_size(), for XML. As the namespace prefixes aren't known yet, this is an estimate."""
+    entry = _xml_entry(res_el, resource_type, _FULLURL_PLACEHOLDER, {}, references, _ns(res_el.tag) or "http://hl7.org/fhir")
+    return len(ET.tostring(entry, encoding="unicode").encode("utf-8"))
+
+# ------------------------- Splitting -------------------------
+
+def partition_resources(count: int, links: Iterable[Tuple[int, int]], sizes: Sequence[int], max_entries: Optional[int], max_bytes: Optional[int]) -> List[int]:
+    """Divide resources 0..count-1 over Bundles and return the Bundle number for each resource.
+
+    Resources that are linked (directly or indirectly) always go to the same Bundle. These groups are
+    added to the Bundles in the order of their first resource, starting a new Bundle when adding a group
+    would exceed max_entries or max_bytes. A group that is larger than the limits on its own gets a
+    Bundle of its own, with a warning."""
+    # Union-find, with the lowest index of each group as its root
+    parent = list(range(count))
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    for a, b in links:
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+
+    roots = [find(i) for i in range(count)]
+    group_entries: Dict[int, int] = {}
+    group_bytes: Dict[int, int] = {}
+    for i, root in enumerate(roots):
+        group_entries[root] = group_entries.get(root, 0) + 1
+        group_bytes[root] = group_bytes.get(root, 0) + sizes[i]
+
+    def too_large(entries: int, size: int) -> bool:
+        return (max_entries is not None and entries > max_entries) or (max_bytes is not None and size > max_bytes)
+
+    bundle_of_group: Dict[int, int] = {}
+    bundle, entries, size = 0, 0, 0
+    for root in group_entries:  # in order of first resource
+        if entries > 0 and too_large(entries + group_entries[root], size + group_bytes[root]):
+            bundle, entries, size = bundle + 1, 0, 0
+        if too_large(group_entries[root], group_bytes[root]):
+            print(f"Warning: {group_entries[root]} resources that reference each other exceed the Bundle limits", file=sys.stderr)
+        bundle_of_group[root] = bundle
+        entries += group_entries[root]
+        size += group_bytes[root]
+    return [bundle_of_group[root] for root in roots]
+
+
+def split_output_path(output: Path, number: int) -> Path:
+    """bundle.json -> bundle-0001.json"""
+    return output.with_name(f"{output.stem}-{number:04d}{output.suffix}")
+
+
+def write_split_bundles(entries: Iterable[str], bundle_of: Sequence[int], output: Path, open_sink: Callable[[TextIO], Any]) -> List[Path]:
+    """Write the entries (in resource order) to the Bundle files given by bundle_of. A file is opened
+    when its first entry arrives and closed after its last one, so only the Bundles whose resources are
+    interleaved are open at the same time. Returns the paths that were written."""
+    last_entry = {b: i for i, b in enumerate(bundle_of)}
+    paths = [split_output_path(output, b + 1) for b in range(len(last_entry) or 1)]
+    output.parent.mkdir(parents=True, exist_ok=True)
+    if not last_entry:  # no resources at all: write a single, empty Bundle
+        with paths[0].open("w", encoding="utf-8", newline="") as out:
+            open_sink(out).close()
+        return paths
+
+    open_bundles: Dict[int, Tuple[TextIO, Any]] = {}
+    try:
+        for i, entry in enumerate(entries):
+            b = bundle_of[i]
+            if b not in open_bundles:
+                out = paths[b].open("w", encoding="utf-8", newline="")
+                open_bundles[b] = (out, open_sink(out))
+            open_bundles[b][1].add(entry)
+            if last_entry[b] == i:
+                out, sink = open_bundles.pop(b)
+                sink.close()
+                out.close()
+    finally:
+        for out, _ in open_bundles.values():
+            out.close()
+    return paths
 
+# ------------------------- Parallel processing -------------------------
+
+# Set by _init_worker() in each worker process (or in this process when not running in parallel)
+_worker_refmap: Dict[str, str] = {}
+_worker_fullurls: Dict[int, str] = {}
+_worker_xml_writer: Optional[XmlBundleWriter] = None
+_worker_index: Optional[ReferenceIndex] = None
+
+
+def parallel_map(func: Callable[[Any], Any], items: Sequence[Any], jobs: int, initializer: Optional[Callable[..., None]] = None, initargs: Tuple = ()) -> Iterable[Any]:
+    """Like map(), but spread over up to `jobs` processes. Results are yielded in the order of items,
+    so the output is the same as when running serially (jobs <= 1)."""
+    if jobs <= 1 or len(items) <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        yield from map(func, items)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=initializer, initargs=initargs) as pool:
+        yield from pool.map(func, items, chunksize=max(1, len(items) // (jobs * 8)))
+
+
+def _scan_json_file(path: Path, references: bool = False, sizes: bool = False, index: Optional[ReferenceIndex] = None) -> Tuple[List[ScannedResource], List[str]]:
+    """Return the resources in a JSON file (and no namespaces, see _scan_xml_file())."""
+    resources = []
+    for it in load_json_items(path):
+        resource = ScannedResource(it.resourceType, it.id)
+        refs: List[str] = []
+        if sizes:
+            resource.size = _json_entry_size(it.payload, it.resourceType, refs, index)
+        elif references:
+            _json_entry(it.payload, it.resourceType, _FULLURL_PLACEHOLDER, {}, refs, index)
+        resource.references = tuple(refs) if references else ()
+        resources.append(resource)
+    return resources, []
+
+
+def _scan_xml_file(path: Path, references: bool = False, sizes: bool = False) -> Tuple[List[ScannedResource], List[str]]:
+    """Return the resources in an XML file, and all namespaces used in these resources in order of first
+    appearance."""
+    resources = []
+    uris: Dict[str, None] = {}
+    for res_el in iter_xml_resources(path):
+        resource = ScannedResource(_local(res_el.tag), _read_id_from_xml(res_el), _ns(res_el.tag))
+        for el in res_el.iter():
+            for name in [el.tag, *el.attrib]:
+                uri = _ns(name)
+                if uri is not None:
+                    uris.setdefault(uri)
+        refs: List[str] = []
+        if sizes:
+            resource.size = _xml_entry_size(res_el, resource.resourceType, refs)
+        elif references:
+            _rewrite_references_xml(res_el, {}, refs)
+        resource.references = tuple(refs) if references else ()
+        resources.append(resource)
+    return resources, list(uris)
+
+
+def _init_worker(refmap: Dict[str, str], index_to_fullurl: Dict[int, str], index: Optional[ReferenceIndex] = None, ns: Optional[str] = None, uris: Sequence[str] = ()) -> None:
+    global _worker_refmap, _worker_fullurls, _worker_index, _worker_xml_writer
+    _worker_refmap, _worker_fullurls, _worker_index = refmap, index_to_fullurl, index
+    _worker_xml_writer = XmlBundleWriter(ns, uris) if ns is not None else None
+
+
+def _iter_json_file_entries(task: Tuple[Path, int], unresolved: List[str]) -> Iterable[str]:
+    path, start = task
+    for entry in iter_json_entries([path], _worker_fullurls, _worker_refmap, unresolved, start, _worker_index):
+        yield _dumps_json(entry)
+
+
+def _iter_xml_file_entries(task: Tuple[Path, int], unresolved: List[str]) -> Iterable[str]:
+    path, i = task
+    for res_el in iter_xml_resources(path):
+        entry = _xml_entry(res_el, _local(res_el.tag), _worker_fullurls[i], _worker_refmap, unresolved, _worker_xml_writer.ns)
+        yield _worker_xml_writer.serialize(entry)
+        i += 1
+
+
+def _collect_file_entries(iter_entries: Callable[[Tuple[Path, int], List[str]], Iterable[str]], task: Tuple[Path, int]) -> Tuple[List[str], List[str]]:
     unresolved: List[str] = []
+    return list(iter_entries(task, unresolved)), unresolved
 
-    for i, it in enumerate(items_list):
-        entry = ET.SubElement(bundle, T("entry"))
-        full = ET.SubElement(entry, T("fullUrl"))
-        full.set("value", index_to_fullurl[i])
-
-        res_container = ET.SubElement(entry, T("resource"))
-        res_el = copy.deepcopy(it.payload)
-        for child in list(res_el):
-            if _local(child.tag) == "id":
-                res_el.remove(child)
-                break
-        _rewrite_references_xml(res_el, refmap, unresolved)
-        res_container.append(res_el)
-
-        req = ET.SubElement(entry, T("request"))
-        m_el = ET.SubElement(req, T("method"))
-        m_el.set("value", "POST")
-        u_el = ET.SubElement(req, T("url"))
-        u_el.set("value", it.resourceType)
 
-    if unresolved:
-        print("Warning: unresolved references detected:", file=sys.stderr)
-        for r in sorted(set(unresolved)):
-            print(f"  - {r}", file=sys.stderr)
+def serialized_entries(iter_entries: Callable[[Tuple[Path, int], List[str]], Iterable[str]], tasks: Sequence[Tuple[Path, int]], jobs: int, initargs: Tuple, unresolved: List[str]) -> Iterable[str]:
+    """Yield the serialized entries for (file, index of its first resource) tasks, in order. When running
+    serially, the entries are streamed one by one; worker processes return the entries per file."""
+    if jobs <= 1 or len(tasks) <= 1:
+        _init_worker(*initargs)
+        for task in tasks:
+            yield from iter_entries(task, unresolved)
+        return
+    for file_entries, file_unresolved in parallel_map(functools.partial(_collect_file_entries, iter_entries), tasks, jobs, _init_worker, initargs):
+        unresolved.extend(file_unresolved)
+        yield from file_entries
 
-    return ET.ElementTree(bundle)
+
+def _file_tasks(files: Sequence[Path], scanned: Sequence[Sequence[ScannedResource]]) -> List[Tuple[Path, int]]:
+    tasks = []
+    start = 0
+    for f, resources in zip(files, scanned):
+        tasks.append((f, start))
+        start += len(resources)
+    return tasks
+
+
+def _write_output(output: Optional[Path], write: Callable[[TextIO], None]) -> int:
+    if output:
+        try:
+            output.parent.mkdir(parents=True, exist_ok=True)
+            with output.open("w", encoding="utf-8", newline="") as out:
+                write(out)
+        except OSError as e:
+            print(f"Failed to write {output}: {e}", file=sys.stderr)
+            return 3
+    else:
+        write(sys.stdout)
+    return 0
+
+# ------------------------- Build cache -------------------------
+
+class BuildCache:
+    """SQLite database with, for each input file of the previous build, the results of the first pass and the
+    serialized entries. An input file is only read again if its size or modification time has changed. The
+    entries of a file are only serialized again if its resources or the resources it references got other
+    fullUrls, or if the namespaces of an XML Bundle have changed; see entries_key().
+
+    The cache is cleared when it was used with another kind of input or reference index. Changes are only
+    stored when commit() is called, so a failed build doesn't leave a half-updated cache."""
+    VERSION = 2  # increase when the cached data changes
+
+    def __init__(self, path: Path, fingerprint: str):
+        self._db = sqlite3.connect(str(path))
+        self._db.execute("""CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            sizes INTEGER NOT NULL,
+            scan TEXT NOT NULL,
+            entries_key TEXT,
+            entries TEXT)""")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        fingerprint = f"{self.VERSION}:{fingerprint}"
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+        if row is None or row[0] != fingerprint:
+            self._db.execute("DELETE FROM files")
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)", (fingerprint,))
+        # Everything but the entries is read in one go, as looking up each file separately adds up
+        self._files = {row[0]: row[1:] for row in self._db.execute("SELECT path, size, mtime_ns, sizes, scan, entries_key FROM files")}
+        self._stats: Dict[str, Tuple[int, int]] = {}
+
+    def _stat(self, path: Path) -> Tuple[int, int]:
+        key = path.as_posix()
+        if key not in self._stats:
+            st = path.stat()
+            self._stats[key] = (st.st_size, st.st_mtime_ns)
+        return self._stats[key]
+
+    def scan(self, path: Path, sizes: bool) -> Optional[Tuple[List[ScannedResource], List[str]]]:
+        """Return the cached result of the first pass over an unchanged file, or None. If sizes is set, the
+        result must include the sizes of the entries."""
+        row = self._files.get(path.as_posix())
+        if row is None or row[:2] != self._stat(path) or row[2] < sizes:
+            return None
+        resources, uris = json.loads(row[3])
+        return [ScannedResource(t, i, ns, tuple(refs), sz) for t, i, ns, refs, sz in resources], uris
+
+    def store_scan(self, path: Path, sizes: bool, scanned: Tuple[List[ScannedResource], List[str]]) -> None:
+        """Store the result of the first pass over a file. This drops the cached entries of the file."""
+        size, mtime_ns = self._stat(path)
+        resources, uris = scanned
+        data = json.dumps([[[r.resourceType, r.id, r.ns, r.references, r.size] for r in resources], uris])
+        self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, NULL, NULL)",
+                         (path.as_posix(), size, mtime_ns, int(sizes), data))
+        self._files[path.as_posix()] = (size, mtime_ns, int(sizes), data, None)
+
+    @staticmethod
+    def entries_key(fullurls: Sequence[str], references: Iterable[str], refmap: Dict[str, str], writer: Sequence[Any]) -> str:
+        """Everything the serialized entries of a file depend on, other than its contents: the fullUrls of its
+        resources, the fullUrls its references resolve to, and the namespaces of the XML writer."""
+        resolved = [f"{ref}={refmap.get(ref)}" for ref in sorted(set(references))]
+        return hashlib.sha256("\n".join([*fullurls, "", *resolved, "", *writer]).encode("utf-8")).hexdigest()
+
+    def has_entries(self, path: Path, key: str) -> bool:
+        row = self._files.get(path.as_posix())
+        return row is not None and row[4] == key
+
+    # The entries are stored separated by NUL characters, which JSON escapes and XML doesn't allow
+
+    def entries(self, path: Path) -> List[str]:
+        text = self._db.execute("SELECT entries FROM files WHERE path = ?", (path.as_posix(),)).fetchone()[0]
+        return text.split("\0") if text else []
+
+    def store_entries(self, path: Path, key: str, entries: List[str]) -> None:
+        self._db.execute("UPDATE files SET entries_key = ?, entries = ? WHERE path = ?", (key, "\0".join(entries), path.as_posix()))
+
+    def commit(self, paths: Iterable[Path]) -> None:
+        """Store the changes, and drop the files that weren't part of this build."""
+        self._db.execute("CREATE TEMP TABLE current (path TEXT PRIMARY KEY)")
+        self._db.executemany("INSERT OR IGNORE INTO current VALUES (?)", ((p.as_posix(),) for p in paths))
+        self._db.execute("DELETE FROM files WHERE path NOT IN (SELECT path FROM current)")
+        self._db.execute("DROP TABLE current")
+        self._db.commit()
+
+    def close(self) -> None:
+        self._db.close()
+
+
+def _file_entry_lists(iter_entries: Callable[[Tuple[Path, int], List[str]], Iterable[str]], tasks: Sequence[Tuple[Path, int]], jobs: int, initargs: Tuple, unresolved: List[str]) -> Iterable[List[str]]:
+    """Like serialized_entries(), but yields the list of entries of each file."""
+    if jobs <= 1 or len(tasks) <= 1:
+        _init_worker(*initargs)
+        for task in tasks:
+            yield list(iter_entries(task, unresolved))
+        return
+    for file_entries, file_unresolved in parallel_map(functools.partial(_collect_file_entries, iter_entries), tasks, jobs, _init_worker, initargs):
+        unresolved.extend(file_unresolved)
+        yield file_entries
+
+
+def cached_serialized_entries(cache: BuildCache, keys: Sequence[str], iter_entries: Callable[[Tuple[Path, int], List[str]], Iterable[str]], tasks: Sequence[Tuple[Path, int]], jobs: int, initargs: Tuple, unresolved: List[str]) -> Iterable[str]:
+    """Like serialized_entries(), taking the entries of a file from the cache if they are there for its key
+    (see BuildCache.entries_key()), and storing them otherwise."""
+    cached = [cache.has_entries(path, key) for (path, _), key in zip(tasks, keys)]
+    fresh = iter(_file_entry_lists(iter_entries, [t for t, c in zip(tasks, cached) if not c], jobs, initargs, unresolved))
+    for (path, _), key, is_cached in zip(tasks, keys, cached):
+        if is_cached:
+            yield from cache.entries(path)
+        else:
+            file_entries = next(fresh)
+            cache.store_entries(path, key, file_entries)
+            yield from file_entries
+
+# ------------------------- Posting -------------------------
+
+POST_TIMEOUT = 600  # seconds; large transactions can take a while to process
+RETRY_STATUSES = (429, 503)  # only retried when the server sends Retry-After, see _post_session()
+
+@dataclass
+class PostResult:
+    path: Path
+    entries: int
+    size: int
+    seconds: float
+    status: Optional[int] = None  # None if no response was received
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _post_session(jobs: int, retries: int) -> Any:
+    """Return a requests Session that keeps up to `jobs` connections open, and retries a POST only when it
+    is certain that the server hasn't processed it: on errors while connecting, and on RETRY_STATUSES with a
+    Retry-After header. A transaction is atomic, but not idempotent: after a read timeout or a 502/504 the
+    transaction may well have been committed, and posting it again would create all resources twice."""
+
+    class PostRetry(Retry):
+        def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+            return has_retry_after and super().is_retry(method, status_code, has_retry_after)
+
+    retry = PostRetry(total=retries, connect=retries, read=0, status=retries, other=0, backoff_factor=1,
+                      status_forcelist=RETRY_STATUSES, allowed_methods=frozenset(["POST"]), raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=jobs, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _post_bundle(session: Any, base: str, path: Path, entries: int, content_type: str) -> PostResult:
+    data = path.read_bytes()
+    start = time.monotonic()
+    try:
+        response = session.post(base, data=data, timeout=POST_TIMEOUT,
+                                headers={"Content-Type": content_type, "Accept": content_type})
+    except requests.RequestException as e:
+        return PostResult(path, entries, len(data), time.monotonic() - start, error=str(e))
+    result = PostResult(path, entries, len(data), time.monotonic() - start, response.status_code)
+    if not response.ok:
+        result.error = f"HTTP {response.status_code}: {response.text[:500]}"
+    return result
+
+
+def _format_size(size: float) -> str:
+    return f"{size / 1e6:.1f} MB" if size >= 1e6 else f"{size / 1e3:.1f} kB"
+
+
+def _report_post(result: PostResult) -> None:
+    rate = f"{result.entries / result.seconds:.0f} entries/s" if result.seconds > 0 else "-"
+    line = f"{result.path.name}: {result.entries} entries, {_format_size(result.size)} in {result.seconds:.2f} s ({rate})"
+    if result.ok:
+        print(f"{line}, HTTP {result.status}", file=sys.stderr)
+    else:
+        print(f"{line}, failed: {result.error}", file=sys.stderr)
+
+
+def post_bundles(base: str, bundles: Sequence[Tuple[Path, int]], content_type: str, jobs: int, retries: int) -> List[PostResult]:
+    """POST the (Bundle file, number of entries) to the FHIR server at base, with at most `jobs` at the same
+    time. Each result is reported on stderr when it comes in, followed by a summary. The results are returned
+    in the order of the bundles."""
+    session = _post_session(jobs, retries)
+    start = time.monotonic()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(_post_bundle, session, base, path, entries, content_type) for path, entries in bundles]
+            for future in concurrent.futures.as_completed(futures):
+                _report_post(future.result())
+            results = [future.result() for future in futures]
+    finally:
+        session.close()
+    seconds = time.monotonic() - start
+    posted = [r for r in results if r.ok]
+    entries = sum(r.entries for r in posted)
+    size = sum(r.size for r in posted)
+    summary = f"Posted {len(posted)} of {len(results)} Bundle(s) with {entries} entries in {seconds:.1f} s"
+    if seconds > 0:
+        summary += f" ({entries / seconds:.0f} entries/s, {_format_size(size / seconds)}/s)"
+    print(summary, file=sys.stderr)
+    return results
 
 # ------------------------- CLI / Orchestration -------------------------
 
@@ -238,14 +992,31 @@ def parse_args(argv: List[str]) -> Tuple[List[Path], Options]:
     p = argparse.ArgumentParser(description="Wrap FHIR resources into a transaction Bundle")
     p.add_argument("inputs", nargs="+", help="Input files or directories (.json/.xml)")
     p.add_argument("-o", "--output", type=Path, help="Output file (json or xml, determined by inputs)")
+    p.add_argument("-j", "--jobs", type=int, default=1, help="Number of processes to read the input files with (0 = number of CPUs, default 1)")
+    p.add_argument("--max-entries", type=int, help="Split the output over multiple Bundles with at most this number of entries each")
+    p.add_argument("--max-bytes", type=int, help="Split the output over multiple Bundles of at most (approximately) this size each")
+    p.add_argument("--structure-definitions", type=Path, nargs="+", default=[], metavar="PATH",
+                   help="FHIR StructureDefinitions (JSON files or directories) to look up where references can occur in JSON resources")
+    p.add_argument("--cache", type=Path, help="Build cache file, to only process the input files that changed since the previous build")
+    p.add_argument("--id-map", type=Path, help="JSON file with the fullUrl for each resource, which is used and updated")
+    p.add_argument("--post-to", metavar="BASE", help="POST the Bundle(s) to the FHIR server with this base URL")
+    p.add_argument("--post-jobs", type=int, default=4, help="Number of Bundles to POST at the same time (default 4)")
+    p.add_argument("--post-retries", type=int, default=3, help="Number of times to retry a POST when it couldn't connect, or when the server asks to retry later (default 3)")
     args = p.parse_args(argv)
-    return [Path(s) for s in args.inputs], Options(args.output)
+    opts = Options(args.output, args.jobs, args.max_entries, args.max_bytes, args.structure_definitions,
+                   args.post_to, max(args.post_jobs, 1), max(args.post_retries, 0), args.id_map, args.cache)
+    if opts.split and not opts.output and not opts.post_to:
+        p.error("--max-entries and --max-bytes require -o/--output, which is numbered for each Bundle")
+    return [Path(s) for s in args.inputs], opts
 
 
 def main(argv: List[str]) -> int:
     inputs, opts = parse_args(argv)
 
-    files = list(iter_input_paths(inputs))
+    files, sources = [], []
+    for path, source in iter_input_sources(inputs):
+        files.append(path)
+        sources.append(source)
     if not files:
         print("No input files found (accepted: .json, .xml)", file=sys.stderr)
         return 1
@@ -256,47 +1027,152 @@ def main(argv: List[str]) -> int:
         return 2
 
     kind = kinds.pop()
+    jobs = opts.jobs if opts.jobs > 0 else (os.cpu_count() or 1)
+
+    if opts.post_to and requests is None:
+        print("--post-to requires the requests package (pip install requests)", file=sys.stderr)
+        return 4
+    if opts.post_to and not opts.output:
+        # The Bundles are only needed for posting
+        with tempfile.TemporaryDirectory() as tmp:
+            return _wrap(files, sources, kind, jobs, replace(opts, output=Path(tmp) / f"bundle.{kind}"))
+    return _wrap(files, sources, kind, jobs, opts)
+
+
+def _wrap(files: Sequence[Path], sources: Sequence[str], kind: str, jobs: int, opts: Options) -> int:
+    """Write the Bundle(s) for the input files of the given kind, and POST them if requested. sources are
+    the names of the files used for the fullUrls, see iter_input_sources()."""
+    index = None
+    if opts.structure_definitions and kind == "json":
+        index = load_reference_index(opts.structure_definitions)
+        if index is None:
+            print("No StructureDefinitions found in " + ", ".join(str(p) for p in opts.structure_definitions), file=sys.stderr)
+            return 1
+
+    cache = None
+    if opts.cache:
+        index_key = hashlib.sha256(json.dumps(index.keys, sort_keys=True).encode("utf-8")).hexdigest() if index else None
+        try:
+            cache = BuildCache(opts.cache, json.dumps([kind, index_key]))
+        except sqlite3.Error as e:
+            print(f"Failed to open {opts.cache}: {e}", file=sys.stderr)
+            return 1
+    try:
+        return _wrap_files(files, sources, kind, jobs, opts, index, cache)
+    finally:
+        if cache is not None:
+            cache.close()
+
 
+def _wrap_files(files: Sequence[Path], sources: Sequence[str], kind: str, jobs: int, opts: Options, index: Optional[ReferenceIndex], cache: Optional[BuildCache]) -> int:
+    """See _wrap(). When a cache is given, only the changed input files are read, and it's updated on success."""
+    # First pass: only collect the resource types and ids (and what's needed for splitting or caching), to
+    # know all fullUrls before references are rewritten
+    sizes = opts.max_bytes is not None
+    references = opts.split or cache is not None
     if kind == "json":
-        items: List[ResourceItem] = []
-        for f in files:
-            items.extend(load_json_items(f))
-        bundle = build_json_bundle(items)
-        out = json.dumps(bundle, indent=2, ensure_ascii=False)
-        if opts.output:
-            try:
-                opts.output.parent.mkdir(parents=True, exist_ok=True)
-                opts.output.write_text(out + "\n", encoding="utf-8")
-            except OSError as e:
-                print(f"Failed to write {opts.output}: {e}", file=sys.stderr)
-                return 3
-        else:
-            print(out)
-        return 0
+        scan = functools.partial(_scan_json_file, references=references, sizes=sizes, index=index)
+    else:
+        scan = functools.partial(_scan_xml_file, references=references, sizes=sizes)
+    if cache is None:
+        scanned_files = list(parallel_map(scan, files, jobs))
+    else:
+        scanned_files = [cache.scan(f, sizes) for f in files]
+        changed = [i for i, result in enumerate(scanned_files) if result is None]
+        for i, result in zip(changed, parallel_map(scan, [files[i] for i in changed], jobs)):
+            scanned_files[i] = result
+            cache.store_scan(files[i], sizes, result)
+    scanned = [file_resources for file_resources, _ in scanned_files]
+    uris = list(dict.fromkeys(uri for _, file_uris in scanned_files for uri in file_uris))
+    del scanned_files
+    resources = [r for file_resources in scanned for r in file_resources]
+    id_map = None
+    if opts.id_map:
+        try:
+            id_map = load_id_map(opts.id_map)
+        except (OSError, ValueError) as e:
+            print(f"Failed to read {opts.id_map}: {e}", file=sys.stderr)
+            return 1
+    _, refmap, index_to_fullurl = _assign_fullurls(
+        (ResourceItem(kind, r.resourceType, r.id, None) for r in resources),
+        (source for source, file_resources in zip(sources, scanned) for _ in file_resources),
+        id_map,
+    )
+    tasks = _file_tasks(files, scanned)
 
-    # XML path
-    xml_items: List[ResourceItem] = []
-    first_ns: Optional[str] = None
-    for f in files:
-        for it in load_xml_items(f):
-            xml_items.append(it)
-            if first_ns is None:
-                first = it.payload
-                first_ns = _ns(first.tag)
-    tree = build_xml_bundle(xml_items, first_ns)
-
-    if opts.output:
+    if kind == "json":
+        iter_entries, initargs = _iter_json_file_entries, (refmap, index_to_fullurl, index)
+        open_sink: Callable[[TextIO], Any] = JsonBundleSink
+        writer_key: List[str] = []
+    else:
+        first_ns = next((r.ns for r in resources if r.ns is not None), None)
+        ns = first_ns or "http://hl7.org/fhir"
+        writer = XmlBundleWriter(ns, uris)
+        iter_entries, initargs = _iter_xml_file_entries, (refmap, index_to_fullurl, None, ns, uris)
+        open_sink = lambda out: XmlBundleSink(writer, out, stdout=out is sys.stdout)
+        writer_key = [ns, *uris]
+
+    unresolved: List[str] = []
+    if cache is not None:
+        keys = [
+            BuildCache.entries_key([index_to_fullurl[start + k] for k in range(len(file_resources))],
+                                   (ref for r in file_resources for ref in r.references), refmap, writer_key)
+            for (_, start), file_resources in zip(tasks, scanned)
+        ]
+        # Entries taken from the cache aren't rewritten again, so look up their unresolved references here
+        unresolved.extend(ref for r in resources for ref in r.references if ref not in refmap)
+    del scanned
+
+    bundle_of: List[int] = []
+    if opts.split:
+        index_of = {f"{r.resourceType}/{r.id}": i for i, r in enumerate(resources) if r.id}
+        links = ((i, index_of[ref]) for i, r in enumerate(resources) for ref in r.references if ref in index_of)
+        entry_sizes = [r.size + sum(len(refmap[ref]) - len(ref) for ref in r.references if ref in refmap) for r in resources]
+        bundle_of = partition_resources(len(resources), links, entry_sizes, opts.max_entries, opts.max_bytes)
+    entry_count = len(resources)
+    del resources
+
+    # Second pass: stream the entries to the output
+    if cache is None:
+        entries = serialized_entries(iter_entries, tasks, jobs, initargs, unresolved)
+    else:
+        entries = cached_serialized_entries(cache, keys, iter_entries, tasks, jobs, initargs, unresolved)
+    bundles: List[Tuple[Path, int]] = []
+    if opts.split:
         try:
-            opts.output.parent.mkdir(parents=True, exist_ok=True)
-            tree.write(opts.output, encoding="utf-8", xml_declaration=True)
+            paths = write_split_bundles(entries, bundle_of, opts.output, open_sink)
+            counts = collections.Counter(bundle_of)
+            bundles = [(path, counts[b]) for b, path in enumerate(paths)]
+            status = 0
         except OSError as e:
             print(f"Failed to write {opts.output}: {e}", file=sys.stderr)
-            return 3
+            status = 3
     else:
-        sys.stdout.write("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n")
-        sys.stdout.write(ET.tostring(tree.getroot(), encoding="unicode"))
-        sys.stdout.write("\n")
-    return 0
+        def write(out: TextIO) -> None:
+            sink = open_sink(out)
+            for entry in entries:
+                sink.add(entry)
+            sink.close()
+        status = _write_output(opts.output, write)
+        bundles = [(opts.output, entry_count)]
+    _warn_unresolved(unresolved)
+
+    if status == 0 and id_map is not None:
+        try:
+            save_id_map(opts.id_map, id_map)
+        except OSError as e:
+            print(f"Failed to write {opts.id_map}: {e}", file=sys.stderr)
+            status = 3
+
+    if status == 0 and cache is not None:
+        cache.commit(files)
+
+    if status == 0 and opts.post_to:
+        content_type = "application/fhir+json" if kind == "json" else "application/fhir+xml"
+        results = post_bundles(opts.post_to, bundles, content_type, opts.post_jobs, opts.post_retries)
+        if not all(r.ok for r in results):
+            status = 4
+    return status
 
 if __name__ == "__main__":
     sys.exit(main(sys.argv[1:]))